@@ -0,0 +1,54 @@
+"""Time the creation of deep and wide layer hierarchies, which computes
+their resolution orders.
+
+Run it with::
+
+    python benchmarks/layers_bench.py
+"""
+
+from plone.testing import Layer
+
+import time
+
+
+def deepChain(depth=300):
+    layer = Layer(name="Layer 0")
+    for i in range(1, depth):
+        layer = Layer((layer,), name=f"Layer {i}")
+
+
+def wideLayer(width=300):
+    bases = tuple(Layer(name=f"Base {i}") for i in range(width))
+    Layer(bases, name="Wide")
+
+
+def diamonds(levels=14, width=6):
+    level = [Layer(name=f"Layer 0.{i}") for i in range(width)]
+    for depth in range(1, levels):
+        level = [
+            Layer(tuple(level[i : i + 2]), name=f"Layer {depth}.{i}")
+            for i in range(width)
+        ]
+
+
+def sharedBases(count=1000):
+    bases = tuple(Layer(name=f"Base {i}") for i in range(3))
+    for i in range(count):
+        Layer(bases, name=f"Layer {i}")
+
+
+def main():
+    for name, build in [
+        ("deep chain of 300 layers", deepChain),
+        ("one layer with 300 bases", wideLayer),
+        ("14 levels x 6 layers, up to 2 bases", diamonds),
+        ("1000 layers sharing 3 bases", sharedBases),
+    ]:
+        started = time.perf_counter()
+        build()
+        elapsed = time.perf_counter() - started
+        print(f"{name:<36} {elapsed * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,31 @@
+"""Compare the cost of making the ``request`` resource of the testing layers
+with ``makeTestRequest()`` and with a ``RequestFactory``.
+
+Run it with::
+
+    python benchmarks/requests_bench.py [number]
+"""
+
+from plone.testing import zope
+
+import sys
+import timeit
+
+ENVIRON = {"SERVER_NAME": "nohost", "SERVER_PORT": "80"}
+
+
+def main(number=50000):
+    factory = zope.RequestFactory(ENVIRON)
+    factory()  # Make the prototype
+
+    candidates = [
+        ("makeTestRequest()", lambda: zope.makeTestRequest(dict(ENVIRON))),
+        ("RequestFactory()()", factory),
+    ]
+    for name, makeRequest in candidates:
+        seconds = min(timeit.repeat(makeRequest, number=number, repeat=3))
+        print(f"{name:<20} {seconds / number * 1000000:6.1f} us per request")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -33,12 +33,18 @@ setup(
         f"{Path('CHANGES.rst').read_text()}\n"
         "Detailed documentation\n======================"
         f"{(testing_folder / 'layer.rst').read_text()}\n"
+        f"{(testing_folder / 'instrumentation.rst').read_text()}\n"
         f"{(testing_folder / 'zca.rst').read_text()}\n"
         f"{(testing_folder / 'security.rst').read_text()}\n"
         f"{(testing_folder / 'publisher.rst').read_text()}\n"
         f"{(testing_folder / 'zodb.rst').read_text()}\n"
         f"{(testing_folder / 'zope.rst').read_text()}\n"
         f"{(testing_folder / 'zserver.rst').read_text()}\n"
+        f"{(testing_folder / 'runner.rst').read_text()}\n"
+        f"{(testing_folder / 'zygote.rst').read_text()}\n"
+        f"{(testing_folder / 'loadtesting.rst').read_text()}\n"
+        f"{(testing_folder / 'profiling.rst').read_text()}\n"
+        f"{(testing_folder / 'accesslog.rst').read_text()}\n"
     ),
     classifiers=[
         "Development Status :: 5 - Production/Stable",
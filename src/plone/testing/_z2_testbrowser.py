@@ -1,3 +1,4 @@
+from plone.testing import instrumentation
 from zope.testbrowser import browser
 from ZPublisher.httpexceptions import HTTPExceptionHandler
 from ZPublisher.utils import basic_auth_encode
@@ -59,7 +60,11 @@ class Zope2Caller:
         publish = publish_module
         if self.browser.handleErrors:
             publish = HTTPExceptionHandler(publish)
-        wsgi_result = publish(environ, start_response)
+        name = "{} {}".format(
+            environ.get("REQUEST_METHOD", "GET"), environ.get("PATH_INFO", "/")
+        )
+        with instrumentation.traced(name, "request"):
+            wsgi_result = publish(environ, start_response)
 
         # Sync transaction
         self.app._p_jar.sync()
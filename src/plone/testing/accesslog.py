@@ -0,0 +1,207 @@
+"""Structured access logs for the test servers
+
+An ``AccessLog`` keeps the most recent requests served by a test server in a
+ring buffer, and the latencies of all of them in a ``LatencyHistogram``.
+The ``WSGIServer`` layer of ``plone.testing.zope`` and the ``ZServer`` layer
+of ``plone.testing.zserver`` make one available as the resource
+``accessLog``.
+"""
+
+import collections
+import json
+import math
+import threading
+import time
+
+
+class LatencyHistogram:
+    """A histogram of latencies in the style of HdrHistogram.
+
+    Latencies are counted in buckets whose width grows with the latency, so
+    that any recorded value is known to ``significantDigits`` decimal digits
+    while the number of buckets only grows with the logarithm of the range.
+    Values are recorded in whole microseconds.
+    """
+
+    def __init__(self, significantDigits=2):
+        self.significantDigits = significantDigits
+        # Values below this are counted exactly. Above, the bucket width
+        # doubles with each power of two.
+        self._subBucketBits = math.ceil(math.log2(2 * 10**significantDigits))
+        self.counts = {}
+        self.count = 0
+        self.min = None
+        self.max = None
+        self._total = 0
+
+    def _bucket(self, value):
+        shift = max(value.bit_length() - self._subBucketBits, 0)
+        return (value >> shift) << shift, (1 << shift)
+
+    def record(self, seconds):
+        """Count a latency of ``seconds``."""
+        value = max(round(seconds * 1000000), 0)
+        lowest = self._bucket(value)[0]
+        self.counts[lowest] = self.counts.get(lowest, 0) + 1
+        self.count += 1
+        self._total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    @property
+    def mean(self):
+        """The mean latency in seconds, or ``None``."""
+        if not self.count:
+            return None
+        return self._total / self.count / 1000000
+
+    def percentile(self, percent):
+        """Return the latency in seconds below which ``percent`` percent of
+        the recorded latencies lie, or ``None`` if none were recorded. The
+        result is the highest value of the bucket it falls into.
+        """
+        if not self.count:
+            return None
+        rank = max(math.ceil(percent / 100.0 * self.count), 1)
+        seen = 0
+        for lowest in sorted(self.counts):
+            seen += self.counts[lowest]
+            if seen >= rank:
+                highest = lowest + self._bucket(lowest)[1] - 1
+                return min(highest, self.max) / 1000000
+        return self.max / 1000000
+
+    def asDict(self):
+        """Return the histogram as a dict that can be saved as JSON."""
+        return {
+            "count": self.count,
+            "min": None if self.min is None else self.min / 1000000,
+            "max": None if self.max is None else self.max / 1000000,
+            "mean": self.mean,
+            "percentiles": {
+                str(percent): self.percentile(percent)
+                for percent in (50, 90, 95, 99, 99.9)
+            },
+            "significantDigits": self.significantDigits,
+            "buckets": [
+                [lowest / 1000000, self.counts[lowest]]
+                for lowest in sorted(self.counts)
+            ],
+        }
+
+
+class AccessLog:
+    """The requests served by a test server.
+
+    ``entries`` holds the last ``size`` requests, each a dict with the keys
+    ``time``, ``method``, ``path``, ``status``, ``bytes`` and ``duration``.
+    ``requests`` is the total number of requests, and ``histogram`` a
+    ``LatencyHistogram`` of all of their durations.
+    """
+
+    def __init__(self, size=1000):
+        self.entries = collections.deque(maxlen=size)
+        self.histogram = LatencyHistogram()
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def record(self, method, path, status, bytes, duration):
+        """Record a request that took ``duration`` seconds."""
+        entry = {
+            "time": time.time(),
+            "method": method,
+            "path": path,
+            "status": status,
+            "bytes": bytes,
+            "duration": duration,
+        }
+        with self._lock:
+            self.entries.append(entry)
+            self.histogram.record(duration)
+            self.requests += 1
+
+    def asDict(self):
+        """Return the log as a dict that can be saved as JSON."""
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "entries": list(self.entries),
+                "histogram": self.histogram.asDict(),
+            }
+
+    def dump(self, path):
+        """Save the log as JSON to the file ``path``."""
+        with open(path, "w") as logFile:
+            json.dump(self.asDict(), logFile, indent=2)
+
+
+class AccessLogMiddleware:
+    """Record the requests to the WSGI application ``app`` in ``accessLog``.
+
+    A request is recorded once its response has been sent, so the duration
+    includes iterating over the response body. Bodies that are lists or
+    tuples, as the Zope publisher usually returns, are complete already, so
+    their requests are recorded right away and they are passed on
+    unchanged.
+    """
+
+    def __init__(self, app, accessLog):
+        self.app = app
+        self.accessLog = accessLog
+
+    def __call__(self, environ, start_response):
+        started = time.perf_counter()
+        response = {"status": None}
+
+        def startResponse(status, headers, exc_info=None):
+            response["status"] = int(status.split(" ", 1)[0])
+            return start_response(status, headers, exc_info)
+
+        try:
+            body = self.app(environ, startResponse)
+        except BaseException:
+            self._record(environ, 500, 0, started)
+            raise
+        if isinstance(body, (list, tuple)):
+            size = sum(len(chunk) for chunk in body)
+            self._record(environ, response["status"], size, started)
+            return body
+        return _LoggedBody(
+            body,
+            lambda size: self._record(environ, response["status"], size, started),
+        )
+
+    def _record(self, environ, status, size, started):
+        self.accessLog.record(
+            environ.get("REQUEST_METHOD", "GET"),
+            environ.get("PATH_INFO", ""),
+            status,
+            size,
+            time.perf_counter() - started,
+        )
+
+
+class _LoggedBody:
+    """Count the bytes of a response body and call ``done`` with the count
+    when the server closes it.
+    """
+
+    def __init__(self, body, done):
+        self._body = body
+        self._done = done
+        self._size = 0
+
+    def __iter__(self):
+        for chunk in self._body:
+            self._size += len(chunk)
+            yield chunk
+
+    def close(self):
+        try:
+            close = getattr(self._body, "close", None)
+            if close is not None:
+                close()
+        finally:
+            self._done(self._size)
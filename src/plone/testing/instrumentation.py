@@ -0,0 +1,326 @@
+"""Opt-in timing instrumentation for layer lifecycles
+
+Recording is switched on by calling ``enable()``, or by setting the
+environment variable ``PLONE_TESTING_TIMINGS`` to the path of a JSON file,
+which is then written when the process exits.
+
+A timeline in the Chrome trace event format, which can be loaded into
+``chrome://tracing`` or Perfetto, is recorded in the same way with
+``enableTrace()`` or the environment variable ``PLONE_TESTING_TRACE``.
+
+ZODB load and store counters, summarised per layer in the same report, are
+switched on with ``enableZODBCounters()`` or the environment variable
+``PLONE_TESTING_ZODB_COUNTERS``. See ``plone.testing.zodb.CountingStorage``.
+"""
+
+import atexit
+import contextlib
+import json
+import os
+import threading
+import time
+
+# Read by the lifecycle method wrappers in ``plone.testing.layer`` on every
+# call, so keep it a plain module global. It is true if either timings or a
+# trace are being recorded.
+enabled = False
+
+_timingsEnabled = False
+_traceEnabled = False
+_zodbCountersEnabled = False
+
+# layer id -> phase -> [calls, wall time, CPU time]
+_timings = {}
+
+# layer id -> summary of the ZODB counters of its tests
+_zodbCounters = {}
+
+# layer id -> number of times a lazy server made its application or not
+_serverStarts = {}
+
+# Chrome trace events, in the order in which they were completed
+_traceEvents = []
+_traceStart = time.perf_counter()
+
+# (layer id, phase) pairs currently being timed. Used to only record the
+# outermost call when a lifecycle method calls its super-class version.
+_active = set()
+
+_reportPath = None
+_tracePath = None
+_zodbCountersPath = None
+
+
+def layerId(layer):
+    """Return the dotted name used to identify a layer in reports."""
+    return f"{layer.__module__}.{layer.__name__}"
+
+
+def enable(path=None):
+    """Start recording layer lifecycle timings.
+
+    If ``path`` is given, a JSON report is written to it when the process
+    exits.
+    """
+    global enabled, _timingsEnabled, _reportPath
+
+    enabled = _timingsEnabled = True
+    if path is not None:
+        if _reportPath is None:
+            atexit.register(_writeReportAtExit)
+        _reportPath = path
+
+
+def isEnabled():
+    """Return whether lifecycle timings are being recorded."""
+    return _timingsEnabled
+
+
+def disable():
+    """Stop recording. Timings recorded so far are kept."""
+    global enabled, _timingsEnabled
+    _timingsEnabled = False
+    enabled = _traceEnabled
+
+
+def enableTrace(path=None):
+    """Start recording a timeline of layer lifecycle calls, ZCML loading
+    and requests made through the test browser.
+
+    If ``path`` is given, the trace is written to it when the process
+    exits.
+    """
+    global enabled, _traceEnabled, _tracePath
+
+    enabled = _traceEnabled = True
+    if path is not None:
+        if _tracePath is None:
+            atexit.register(_writeTraceAtExit)
+        _tracePath = path
+
+
+def isTraceEnabled():
+    """Return whether a timeline is being recorded."""
+    return _traceEnabled
+
+
+def disableTrace():
+    """Stop recording the timeline. Events recorded so far are kept."""
+    global enabled, _traceEnabled
+    _traceEnabled = False
+    enabled = _timingsEnabled
+
+
+def enableZODBCounters(path=None):
+    """Count ZODB loads and stores in databases created from now on by the
+    layers in ``plone.testing.zodb`` and ``plone.testing.zope``.
+
+    If ``path`` is given, the JSON report is written to it when the process
+    exits.
+    """
+    global _zodbCountersEnabled, _zodbCountersPath
+
+    _zodbCountersEnabled = True
+    if path is not None:
+        if _zodbCountersPath is None:
+            atexit.register(_writeZODBCountersAtExit)
+        _zodbCountersPath = path
+
+
+def isZODBCountingEnabled():
+    """Return whether new databases count loads and stores."""
+    return _zodbCountersEnabled
+
+
+def disableZODBCounters():
+    """Stop counting in databases created from now on. Databases that
+    already count keep doing so.
+    """
+    global _zodbCountersEnabled
+    _zodbCountersEnabled = False
+
+
+def addZODBCounters(layer, counters):
+    """Add the ``StorageCounters`` recorded during one test of ``layer`` to
+    the report.
+    """
+    summary = _zodbCounters.setdefault(
+        layerId(layer),
+        {
+            "tests": 0,
+            "loads": 0,
+            "stores": 0,
+            "bytesLoaded": 0,
+            "bytesStored": 0,
+            "maxLoads": 0,
+        },
+    )
+    summary["tests"] += 1
+    summary["loads"] += counters.loads
+    summary["stores"] += counters.stores
+    summary["bytesLoaded"] += counters.bytesLoaded
+    summary["bytesStored"] += counters.bytesStored
+    summary["maxLoads"] = max(summary["maxLoads"], counters.loads)
+
+
+def addServerStart(layer, started):
+    """Record that a server layer which makes its application lazily was
+    torn down, and whether the application had been made, i.e. ``started``.
+    Always recorded.
+    """
+    counts = _serverStarts.setdefault(layerId(layer), {"started": 0, "avoided": 0})
+    counts["started" if started else "avoided"] += 1
+
+
+def reset():
+    """Forget all recorded timings, trace events, ZODB counters and server
+    starts.
+    """
+    _timings.clear()
+    _zodbCounters.clear()
+    _serverStarts.clear()
+    _active.clear()
+    del _traceEvents[:]
+
+
+@contextlib.contextmanager
+def timed(layer, phase):
+    """Context manager that records the wall and CPU time spent in the
+    block as ``phase`` of ``layer``. Does nothing unless recording is
+    enabled.
+    """
+    if not enabled:
+        yield
+        return
+
+    key = (layerId(layer), phase)
+    if key in _active:
+        yield
+        return
+
+    _active.add(key)
+    wallStart = time.perf_counter()
+    cpuStart = time.process_time()
+    try:
+        yield
+    finally:
+        wallEnd = time.perf_counter()
+        cpu = time.process_time() - cpuStart
+        _active.discard(key)
+
+        if _timingsEnabled:
+            record = _timings.setdefault(key[0], {}).setdefault(phase, [0, 0.0, 0.0])
+            record[0] += 1
+            record[1] += wallEnd - wallStart
+            record[2] += cpu
+
+        if _traceEnabled:
+            _addTraceEvent(f"{key[0]}:{phase}", "layer", wallStart, wallEnd)
+
+
+@contextlib.contextmanager
+def traced(name, category, /, **args):
+    """Context manager that adds the block to the trace as an event called
+    ``name`` in ``category``. Keyword arguments are shown as the event's
+    arguments in the trace viewer. Does nothing unless tracing is enabled.
+    """
+    if not _traceEnabled:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _addTraceEvent(name, category, start, time.perf_counter(), args)
+
+
+def _addTraceEvent(name, category, start, end, args=None):
+    event = {
+        "name": name,
+        "cat": category,
+        "ph": "X",
+        "ts": (start - _traceStart) * 1e6,
+        "dur": (end - start) * 1e6,
+        "pid": os.getpid(),
+        "tid": threading.get_ident(),
+    }
+    if args:
+        event["args"] = args
+    _traceEvents.append(event)
+
+
+def report():
+    """Return the recorded timings, ZODB counters and server starts as a
+    JSON-serialisable dict.
+
+    Layers are listed by the total wall time spent in them, slowest first.
+    ZODB counters are listed by the number of objects loaded, most first.
+    """
+    layers = {}
+    for name, phases in _timings.items():
+        layers[name] = {
+            phase: {"calls": calls, "wall": wall, "cpu": cpu}
+            for phase, (calls, wall, cpu) in sorted(phases.items())
+        }
+
+    def totalWall(item):
+        return sum(p["wall"] for p in item[1].values())
+
+    return {
+        "layers": dict(sorted(layers.items(), key=totalWall, reverse=True)),
+        "zodb": {
+            name: dict(summary)
+            for name, summary in sorted(
+                _zodbCounters.items(), key=lambda item: item[1]["loads"], reverse=True
+            )
+        },
+        "servers": {
+            name: dict(counts) for name, counts in sorted(_serverStarts.items())
+        },
+    }
+
+
+def writeReport(path):
+    """Write the JSON report to ``path``."""
+    with open(path, "w") as reportFile:
+        json.dump(report(), reportFile, indent=2)
+
+
+def trace():
+    """Return the recorded timeline in the Chrome trace event format."""
+    return {
+        "traceEvents": sorted(_traceEvents, key=lambda event: event["ts"]),
+        "displayTimeUnit": "ms",
+    }
+
+
+def writeTrace(path):
+    """Write the recorded timeline to ``path``."""
+    with open(path, "w") as traceFile:
+        json.dump(trace(), traceFile)
+
+
+def _writeReportAtExit():
+    if _reportPath is not None:
+        writeReport(_reportPath)
+
+
+def _writeZODBCountersAtExit():
+    if _zodbCountersPath is not None:
+        writeReport(_zodbCountersPath)
+
+
+def _writeTraceAtExit():
+    if _tracePath is not None:
+        writeTrace(_tracePath)
+
+
+if os.environ.get("PLONE_TESTING_TIMINGS"):
+    enable(os.environ["PLONE_TESTING_TIMINGS"])
+
+if os.environ.get("PLONE_TESTING_TRACE"):
+    enableTrace(os.environ["PLONE_TESTING_TRACE"])
+
+if os.environ.get("PLONE_TESTING_ZODB_COUNTERS"):
+    enableZODBCounters(os.environ["PLONE_TESTING_ZODB_COUNTERS"])
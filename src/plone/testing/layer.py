@@ -1,7 +1,20 @@
+from plone.testing import instrumentation
+
+import functools
 import sys
+import threading
+import weakref
 
 _marker = object()
 
+# Maps the first of a tuple of bases to a dict, which maps weak references to
+# the other bases to weak references to the merged resolution order of all of
+# them. It is shared by every layer with those bases, and does not keep any of
+# them alive.
+_mergedResolutionOrders = weakref.WeakKeyDictionary()
+
+_LIFECYCLE_METHODS = ("setUp", "tearDown", "testSetUp", "testTearDown")
+
 
 class ResourceManager:
     """Mixin class for resource managers."""
@@ -10,14 +23,42 @@ class ResourceManager:
 
     def __init__(self):
         self._resources = {}
+
+        # Maps a resource key to the stack that shadows all others in our
+        # resolution order (or ``None`` if there is no such stack). Stacks
+        # are mutated in place, so an entry only needs to be discarded when
+        # a stack is created or removed for its key; ``_dependents`` holds
+        # the resource managers that have to be told when that happens.
+        self._resourceIndex = {}
+        self._dependents = weakref.WeakSet()
+
         self.baseResolutionOrder = tuple(self._resourceResolutionOrder(self))
 
-    def get(self, key, default=None):
         for resourceManager in self.baseResolutionOrder:
-            if key in getattr(resourceManager, "_resources", {}):
-                # Get the value on the top of the stack
-                return resourceManager._resources[key][-1][0]
-        return default
+            dependents = getattr(resourceManager, "_dependents", None)
+            if dependents is not None:
+                dependents.add(self)
+
+    def get(self, key, default=None):
+        stack = self._indexedStack(key)
+        if stack is None:
+            return default
+        # Get the value on the top of the stack
+        value = stack[-1][0]
+        if type(value) is _LazyResource:
+            return value.get()
+        return value
+
+    def setResourceFactory(self, key, factory, tearDown=None):
+        """Set the resource ``key`` to be made by calling ``factory()`` the
+        first time it is accessed. The value is then kept like any other
+        resource.
+
+        When the resource is deleted, ``tearDown(value)`` is called if the
+        factory was called and ``tearDown`` is given. Resources that were
+        never accessed cost nothing beyond the factory itself.
+        """
+        self[key] = _LazyResource(factory, tearDown)
 
     # Dict API
 
@@ -28,7 +69,7 @@ class ResourceManager:
         return item
 
     def __contains__(self, key):
-        return self.get(key, _marker) is not _marker
+        return self._indexedStack(key) is not None
 
     def __setitem__(self, key, value):
         foundStack = False
@@ -44,7 +85,10 @@ class ResourceManager:
                         # This layer instance has already added an item to
                         # the stack. Update that item instead of pushing a new
                         # item onto the stack.
+                        previous = stack[idx][0]
                         stack[idx][0] = value
+                        if type(previous) is _LazyResource and previous is not value:
+                            previous.discard()
 
                         foundStackItem = True
                         break
@@ -66,6 +110,7 @@ class ResourceManager:
         # This resource is not shadowing any other: create a new stack here
         if not foundStack:
             self._resources[key] = [[value, self]]
+            self._invalidateResourceIndex(key)
 
     def __delitem__(self, key):
         found = False
@@ -74,10 +119,14 @@ class ResourceManager:
                 stack = resourceManager._resources[key]
                 for idx in range(len(stack) - 1, -1, -1):
                     if stack[idx][1] is self:
+                        value = stack[idx][0]
                         del stack[idx]
+                        if type(value) is _LazyResource:
+                            value.discard()
 
                         if len(stack) == 0:
                             del resourceManager._resources[key]
+                            resourceManager._invalidateResourceIndex(key)
 
                         found = True
 
@@ -90,43 +139,135 @@ class ResourceManager:
 
     # Helpers
 
+    def _indexedStack(self, key):
+        try:
+            return self._resourceIndex[key]
+        except KeyError:
+            stack = self._resourceIndex[key] = self._findStack(key)
+            return stack
+
+    def _findStack(self, key):
+        for resourceManager in self.baseResolutionOrder:
+            resources = getattr(resourceManager, "_resources", None)
+            if resources is not None and key in resources:
+                return resources[key]
+        return None
+
+    def _invalidateResourceIndex(self, key):
+        """Forget the indexed stack for ``key`` in every resource manager
+        that has this one in its resolution order.
+        """
+        for resourceManager in self._dependents:
+            resourceManager._resourceIndex.pop(key, None)
+
     # This is basically the Python MRO algorithm, adapted from
     # http://www.python.org/download/releases/2.3/mro/
+    #
+    # Instead of searching every sequence's tail for each candidate, we keep
+    # count of how many tails each resource manager is in, and a position
+    # in each sequence instead of deleting its head. That makes the merge
+    # roughly linear in the total length of the sequences.
 
     def _mergeResourceManagers(self, seqs):
         res = []
-        i = 0
+        positions = [0] * len(seqs)
+
+        inTails = {}
+        for seq in seqs:
+            for resourceManager in seq[1:]:
+                inTails[resourceManager] = inTails.get(resourceManager, 0) + 1
 
         while True:
-            nonemptyseqs = [seq for seq in seqs if seq]
+            cand = None
+            exhausted = True
+
+            for i, seq in enumerate(seqs):  # find merge candidates among heads
+                if positions[i] < len(seq):
+                    exhausted = False
+                    if not inTails.get(seq[positions[i]]):
+                        cand = seq[positions[i]]
+                        break
 
-            if not nonemptyseqs:
+            if exhausted:
                 return res
 
-            i += 1
-
-            for seq in nonemptyseqs:  # find merge candidates among seq heads
-                cand = seq[0]
-                nothead = [s for s in nonemptyseqs if cand in s[1:]]
-                if nothead:
-                    cand = None  # reject candidate
-                else:
-                    break
-
-            if not cand:
+            if cand is None:
                 raise TypeError("Inconsistent layer hierarchy!")
 
             res.append(cand)
-            for seq in nonemptyseqs:  # remove cand
-                if seq[0] == cand:
-                    del seq[0]
+            for i, seq in enumerate(seqs):  # remove cand
+                if positions[i] < len(seq) and seq[positions[i]] == cand:
+                    positions[i] += 1
+                    if positions[i] < len(seq):
+                        inTails[seq[positions[i]]] -= 1
 
     def _resourceResolutionOrder(self, instance):
-        return self._mergeResourceManagers(
-            [[instance]]
-            + list(map(self._resourceResolutionOrder, instance.__bases__))
-            + [list(instance.__bases__)]
-        )
+        bases = tuple(instance.__bases__)
+        if not bases:
+            return [instance]
+
+        try:
+            orders = _mergedResolutionOrders.setdefault(bases[0], {})
+            key = tuple(weakref.ref(base) for base in bases[1:])
+        except TypeError:
+            # Bases that cannot be weakly referenced are not cached
+            orders = key = None
+
+        baseOrder = None
+        if orders is not None and key in orders:
+            baseOrder = tuple(ref() for ref in orders[key])
+            if any(resourceManager is None for resourceManager in baseOrder):
+                baseOrder = None
+
+        if baseOrder is None:
+            baseOrder = tuple(
+                self._mergeResourceManagers(
+                    [list(self._baseResolutionOrder(base)) for base in bases]
+                    + [list(bases)]
+                )
+            )
+            if orders is not None:
+                try:
+                    orders[key] = tuple(map(weakref.ref, baseOrder))
+                except TypeError:
+                    pass
+        return [instance] + list(baseOrder)
+
+    def _baseResolutionOrder(self, base):
+        # A resource manager's order was computed when it was created
+        if isinstance(base, ResourceManager):
+            return base.baseResolutionOrder
+        return self._resourceResolutionOrder(base)
+
+
+class _LazyResource:
+    """A resource value that is made on first access."""
+
+    __slots__ = ("factory", "tearDown", "value", "lock")
+
+    def __init__(self, factory, tearDown=None):
+        self.factory = factory
+        self.tearDown = tearDown
+        self.value = _marker
+        self.lock = threading.Lock()
+
+    def get(self):
+        value = self.value
+        if value is _marker:
+            with self.lock:
+                value = self.value
+                if value is _marker:
+                    value = self.value = self.factory()
+        return value
+
+    def discard(self):
+        """Tear down the value if it was made. The same lazy resource may
+        be on several stacks, so this may be called more than once.
+        """
+        with self.lock:
+            value, self.value = self.value, _marker
+        if value is not _marker and self.tearDown is not None:
+            self.tearDown(value)
 
 
 class Layer(ResourceManager):
@@ -218,6 +359,10 @@ class Layer(ResourceManager):
 
         super().__init__()
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        _instrumentLifecycleMethods(cls)
+
     def __repr__(self):
         return f"<Layer '{self.__module__}.{self.__name__}'>"
 
@@ -236,6 +381,32 @@ class Layer(ResourceManager):
         pass
 
 
+def _instrumented(phase, method):
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if not instrumentation.enabled:
+            return method(self, *args, **kwargs)
+        with instrumentation.timed(self, phase):
+            return method(self, *args, **kwargs)
+
+    wrapper._instrumented = True
+    return wrapper
+
+
+def _instrumentLifecycleMethods(cls):
+    """Wrap the lifecycle methods defined in the body of ``cls`` so that
+    their timings are recorded when ``plone.testing.instrumentation`` is
+    enabled.
+    """
+    for phase in _LIFECYCLE_METHODS:
+        method = cls.__dict__.get(phase)
+        if method is not None and not getattr(method, "_instrumented", False):
+            setattr(cls, phase, _instrumented(phase, method))
+
+
+_instrumentLifecycleMethods(Layer)
+
+
 def layered(suite, layer, addLayerToDoctestGlobs=True):
     """Add the given layer to the given suite and return the suite.
 
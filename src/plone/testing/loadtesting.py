@@ -0,0 +1,231 @@
+"""Load testing against the WSGI server fixture
+
+The ``LOAD_TESTING`` layer extends ``plone.testing.zope.WSGI_SERVER_FIXTURE``
+with a resource ``loadDriver``. Its ``run()`` method sends a number of
+requests to the server from several threads at once and returns a
+``LoadReport`` with the throughput and latency percentiles, which tests can
+assert on to catch throughput regressions.
+"""
+
+from plone.testing import Layer
+from plone.testing import zope
+
+import base64
+import http.client
+import math
+import threading
+import time
+
+
+class LoadRequest:
+    """A request sent by the load driver.
+
+    ``path`` is the path of the URL, including any query string. ``headers``
+    is a dict of extra headers. ``body`` is sent as is, encoded as UTF-8 if
+    it is a string.
+    """
+
+    def __init__(self, path, method="GET", body=None, headers=None):
+        self.path = path
+        self.method = method
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        self.body = body
+        self.headers = dict(headers or {})
+
+    def __repr__(self):
+        return f"<LoadRequest {self.method} {self.path}>"
+
+
+class LoadReport:
+    """The outcome of a load test run.
+
+    ``requests`` is the number of requests sent, ``errors`` the number of
+    them that raised an exception or got a response with a status of 400 or
+    above, and ``statuses`` a dict of response status counts. ``duration``
+    is the wall time of the run in seconds, and ``latencies`` the sorted
+    latencies of the requests in seconds.
+    """
+
+    def __init__(self, latencies, statuses, errors, duration):
+        self.latencies = sorted(latencies)
+        self.statuses = statuses
+        self.errors = errors
+        self.duration = duration
+
+    @property
+    def requests(self):
+        return len(self.latencies)
+
+    @property
+    def requestsPerSecond(self):
+        if not self.duration:
+            return 0.0
+        return self.requests / self.duration
+
+    def percentile(self, percent):
+        """Return the latency below which ``percent`` percent of the requests
+        finished, using the nearest-rank method.
+        """
+        if not self.latencies:
+            return None
+        rank = math.ceil(percent / 100.0 * len(self.latencies))
+        return self.latencies[max(rank, 1) - 1]
+
+    @property
+    def p50(self):
+        return self.percentile(50)
+
+    @property
+    def p95(self):
+        return self.percentile(95)
+
+    @property
+    def p99(self):
+        return self.percentile(99)
+
+    def __repr__(self):
+        return (
+            f"<LoadReport {self.requests} requests, {self.errors} errors, "
+            f"{self.requestsPerSecond:.1f} requests/s>"
+        )
+
+
+class LoadDriver:
+    """Send requests to the server at ``host`` and ``port`` from several
+    threads at once. Each thread keeps its own HTTP connection open.
+
+    ``basicAuth`` is an optional ``(login, password)`` tuple used for all
+    requests.
+    """
+
+    timeout = 30
+
+    def __init__(self, host, port, basicAuth=None):
+        self.host = host
+        self.port = int(port)
+        self.basicAuth = basicAuth
+        self.report = None
+
+    def run(self, requests, concurrency=4, count=None, duration=None):
+        """Send ``requests`` to the server and return a ``LoadReport``, which
+        is also kept as ``self.report``.
+
+        ``requests`` is a sequence of ``LoadRequest`` objects or of paths to
+        get. They are sent in turn, by ``concurrency`` threads at once, until
+        ``count`` requests have been sent or ``duration`` seconds have
+        passed. If neither is given, each request is sent once.
+        """
+        requests = [
+            LoadRequest(request) if isinstance(request, str) else request
+            for request in requests
+        ]
+        if not requests:
+            raise ValueError("No requests to send")
+        if count is None and duration is None:
+            count = len(requests)
+
+        latencies = []
+        statuses = {}
+        errors = []
+        lock = threading.Lock()
+        sent = [0]
+
+        deadline = None
+        start = time.perf_counter()
+        if duration is not None:
+            deadline = start + duration
+
+        def nextRequest():
+            with lock:
+                if count is not None and sent[0] >= count:
+                    return None
+                if deadline is not None and time.perf_counter() >= deadline:
+                    return None
+                index = sent[0]
+                sent[0] += 1
+            return requests[index % len(requests)]
+
+        def work():
+            connection = None
+            try:
+                while True:
+                    request = nextRequest()
+                    if request is None:
+                        break
+                    if connection is None:
+                        connection = http.client.HTTPConnection(
+                            self.host, self.port, timeout=self.timeout
+                        )
+                    started = time.perf_counter()
+                    try:
+                        status, keepAlive = self._send(connection, request)
+                    except (OSError, http.client.HTTPException):
+                        latencies.append(time.perf_counter() - started)
+                        errors.append(request)
+                        connection.close()
+                        connection = None
+                        continue
+                    latencies.append(time.perf_counter() - started)
+                    with lock:
+                        statuses[status] = statuses.get(status, 0) + 1
+                    if status >= 400:
+                        errors.append(request)
+                    if not keepAlive:
+                        connection.close()
+                        connection = None
+            finally:
+                if connection is not None:
+                    connection.close()
+
+        threads = [
+            threading.Thread(target=work, name=f"LoadDriver-{i}")
+            for i in range(concurrency)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.report = LoadReport(
+            latencies, statuses, len(errors), time.perf_counter() - start
+        )
+        return self.report
+
+    def _send(self, connection, request):
+        headers = dict(request.headers)
+        if self.basicAuth is not None and "Authorization" not in headers:
+            credentials = "{}:{}".format(*self.basicAuth).encode("utf-8")
+            headers["Authorization"] = "Basic " + base64.b64encode(credentials).decode(
+                "ascii"
+            )
+        connection.request(
+            request.method, request.path, body=request.body, headers=headers
+        )
+        response = connection.getresponse()
+        response.read()
+        return response.status, not response.will_close
+
+
+class LoadTesting(Layer):
+    """Provide a ``LoadDriver`` for the WSGI server as the resource
+    ``loadDriver``.
+
+    Use it as a base for a ``FunctionalTesting`` layer, so that the tests
+    can commit the content to be requested.
+    """
+
+    defaultBases = (zope.WSGI_SERVER_FIXTURE,)
+
+    def setUp(self):
+        self["loadDriver"] = LoadDriver(self["host"], self["port"])
+
+    def tearDown(self):
+        del self["loadDriver"]
+
+
+LOAD_TESTING_FIXTURE = LoadTesting()
+
+LOAD_TESTING = zope.FunctionalTesting(
+    bases=(LOAD_TESTING_FIXTURE,), name="LoadTesting:Functional"
+)
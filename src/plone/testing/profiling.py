@@ -0,0 +1,178 @@
+"""Profiling of the requests served by a WSGI server layer
+
+``ProfilingMiddleware`` wraps a WSGI application, usually
+``ZPublisher.WSGIPublisher.publish_module``, and runs each request, or every
+n-th request, under ``cProfile``. The statistics are added up per URL
+pattern and written as one ``.pstats`` file per pattern, which can be read
+with ``pstats`` or turned into a call graph or flame graph with tools such
+as ``snakeviz``, ``gprof2dot`` or ``flameprof``.
+
+The ``WSGIServer`` layer of ``plone.testing.zope`` installs the middleware
+when its ``profileDirectory`` attribute, or the environment variable
+``WSGI_SERVER_PROFILE``, is set.
+"""
+
+import cProfile
+import os
+import pstats
+import re
+import threading
+
+_DIGITS = re.compile(r"\d")
+_UNSAFE = re.compile(r"[^\w.@+-]+")
+
+
+def urlPattern(path):
+    """Return the pattern of the URL path ``path``, in which all segments
+    containing a digit, such as ids and dates, are replaced by ``*``.
+    """
+    segments = path.split("/")
+    return "/".join("*" if _DIGITS.search(segment) else segment for segment in segments)
+
+
+class ProfilingMiddleware:
+    """Profile the requests to ``app`` and write the statistics to
+    ``directory``.
+
+    Every ``sampleEvery``-th request of each URL pattern is profiled.
+    ``patterns`` is an optional list of ``(name, regular expression)``
+    tuples. The name of the first expression that matches the path of a
+    request is used as its pattern, before falling back to ``urlPattern()``.
+
+    Only one request is profiled at a time, as Python 3.12 and later allow
+    only one active profiler, which records the calls of all threads. A
+    request is profiled only while no other request is in progress, and
+    the requests that come in meanwhile wait for it to finish, for at most
+    ``timeout`` seconds. Requests that find others in progress, or another
+    profiler active, are served without profiling. The profile covers the
+    response body until the server closes it.
+
+    The statistics are written by ``dump()``.
+    """
+
+    timeout = 5
+
+    def __init__(self, app, directory, sampleEvery=1, patterns=()):
+        self.app = app
+        self.directory = directory
+        self.sampleEvery = int(sampleEvery)
+        if self.sampleEvery < 1:
+            raise ValueError(
+                "sampleEvery must be at least 1, not {}".format(sampleEvery)
+            )
+        self.patterns = [(name, re.compile(regex)) for name, regex in patterns]
+        self.requests = {}
+        self.profiled = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._idle = threading.Condition()
+        self._running = 0
+        self._profiling = False
+
+    def __call__(self, environ, start_response):
+        pattern = self.patternFor(environ)
+        with self._lock:
+            seen = self.requests.get(pattern, 0)
+            self.requests[pattern] = seen + 1
+
+        profile = None
+        with self._idle:
+            self._idle.wait_for(lambda: not self._profiling, self.timeout)
+            if not (seen % self.sampleEvery or self._running or self._profiling):
+                profile = cProfile.Profile()
+                try:
+                    profile.enable()
+                except ValueError:
+                    # Another profiling tool is already active
+                    profile = None
+                else:
+                    self._profiling = True
+            if profile is None:
+                self._running += 1
+
+        try:
+            body = self.app(environ, start_response)
+        except BaseException:
+            self._finish(pattern, profile)
+            raise
+        if isinstance(body, (list, tuple)):
+            # The body is complete, as the Zope publisher's usually is
+            self._finish(pattern, profile)
+            return body
+        return _ProfiledBody(body, lambda: self._finish(pattern, profile))
+
+    def _finish(self, pattern, profile):
+        if profile is not None:
+            profile.disable()
+            self._addProfile(pattern, profile)
+        with self._idle:
+            if profile is None:
+                self._running -= 1
+            else:
+                self._profiling = False
+            self._idle.notify_all()
+
+    def patternFor(self, environ):
+        """Return the key under which the statistics of a request are added
+        up: the request method and the pattern of its path.
+        """
+        path = environ.get("PATH_INFO", "") or "/"
+        for name, regex in self.patterns:
+            if regex.search(path):
+                pattern = name
+                break
+        else:
+            pattern = urlPattern(path)
+        return "{} {}".format(environ.get("REQUEST_METHOD", "GET"), pattern)
+
+    def _addProfile(self, pattern, profile):
+        with self._lock:
+            self.profiled[pattern] = self.profiled.get(pattern, 0) + 1
+            stats = self._stats.get(pattern)
+            if stats is None:
+                self._stats[pattern] = pstats.Stats(profile)
+            else:
+                stats.add(profile)
+
+    def stats(self, pattern):
+        """Return the added up ``pstats.Stats`` of a pattern, or ``None``."""
+        return self._stats.get(pattern)
+
+    def fileName(self, pattern):
+        """Return the name of the file the statistics of a pattern are
+        written to.
+        """
+        name = pattern.replace("*", "ANY")
+        return _UNSAFE.sub("_", name).strip("_") + ".pstats"
+
+    def dump(self):
+        """Write the statistics of each pattern to its file in the directory
+        and return the paths of the files.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        paths = []
+        with self._lock:
+            for pattern, stats in sorted(self._stats.items()):
+                path = os.path.join(self.directory, self.fileName(pattern))
+                stats.dump_stats(path)
+                paths.append(path)
+        return paths
+
+
+class _ProfiledBody:
+    """Call ``done`` when the server closes a response body."""
+
+    def __init__(self, body, done):
+        self._body = body
+        self._done = done
+
+    def __iter__(self):
+        return iter(self._body)
+
+    def close(self):
+        try:
+            close = getattr(self._body, "close", None)
+            if close is not None:
+                close()
+        finally:
+            self._done()
@@ -0,0 +1,505 @@
+"""Helpers for running the tests of a layer outside the usual test runner
+
+The main entry point is ``runForked()``, which sets a layer up once in the
+current process and then forks worker processes that each run a share of
+the layer's tests. The workers inherit the set-up fixture copy-on-write and
+report their results back to the parent over a pipe.
+"""
+
+import multiprocessing.connection
+import os
+import sys
+import traceback
+import unittest
+
+
+class WorkerError(Exception):
+    """Stands in for an exception raised in a worker process. Its message is
+    the formatted traceback from the worker.
+    """
+
+
+def layerName(layer):
+    """Return the dotted name ``zope.testrunner`` uses for ``layer``."""
+    return f"{layer.__module__}.{layer.__name__}"
+
+
+def layerOrder(layer):
+    """Return ``layer`` and all of its bases, each after its own bases.
+
+    This is the order in which ``testSetUp()`` is called before each test.
+    ``testTearDown()`` is called in the reverse order.
+    """
+    gathered = []
+    _gatherLayers(layer, gathered)
+
+    seen = set()
+    result = []
+    for candidate in reversed(gathered):
+        if candidate not in seen:
+            seen.add(candidate)
+            result.append(candidate)
+    return result
+
+
+def _gatherLayers(layer, result):
+    if layer is not object:
+        result.append(layer)
+    for base in layer.__bases__:
+        _gatherLayers(base, result)
+
+
+def setUpLayer(layer, setUpLayers):
+    """Set up ``layer`` and any of its bases that are not in the dict
+    ``setUpLayers`` yet, bases first, and add them to it.
+    """
+    if layer in setUpLayers:
+        return
+    for base in layer.__bases__:
+        if base is not object:
+            setUpLayer(base, setUpLayers)
+    if hasattr(layer, "setUp"):
+        layer.setUp()
+    setUpLayers[layer] = 1
+
+
+def tearDownLayers(setUpLayers):
+    """Tear down the layers in the dict ``setUpLayers``, most recently set
+    up first, and remove them from it.
+    """
+    for layer in reversed(list(setUpLayers)):
+        try:
+            if hasattr(layer, "tearDown"):
+                layer.tearDown()
+        finally:
+            del setUpLayers[layer]
+
+
+def groupByLayer(suite):
+    """Return a dict mapping each layer to the list of tests in ``suite``
+    that run in it, in suite order.
+
+    A test's layer is its own ``layer`` attribute, or else that of the
+    innermost suite containing it, as set by ``plone.testing.layered()``.
+    Tests without a layer are listed under ``None``.
+    """
+    groups = {}
+    _groupTests(suite, None, groups)
+    return groups
+
+
+def _groupTests(test, layer, groups):
+    layer = getattr(test, "layer", layer)
+    if isinstance(test, unittest.BaseTestSuite):
+        for child in test:
+            _groupTests(child, layer, groups)
+    else:
+        groups.setdefault(layer, []).append(test)
+
+
+def neededLayers(layer):
+    """Return ``layer`` and all of its bases, most specific first.
+
+    For ``plone.testing`` layers, this is their ``baseResolutionOrder``, as
+    computed by ``ResourceManager._resourceResolutionOrder()``. Other
+    layers, e.g. plain classes, fall back to ``layerOrder()``.
+    """
+    order = getattr(layer, "baseResolutionOrder", None)
+    if order is None:
+        order = reversed(layerOrder(layer))
+    return tuple(order)
+
+
+def layerCosts(report):
+    """Return a dict mapping layer names to ``(setUp, tearDown)`` costs,
+    the average wall time of each, from a report made by
+    ``plone.testing.instrumentation.report()``, or read from the JSON file
+    written when ``PLONE_TESTING_TIMINGS`` is set.
+    """
+    costs = {}
+    for name, phases in report["layers"].items():
+        costs[name] = tuple(
+            (
+                phases[phase]["wall"] / phases[phase]["calls"]
+                if phases.get(phase, {}).get("calls")
+                else None
+            )
+            for phase in ("setUp", "tearDown")
+        )
+    return costs
+
+
+class _CostModel:
+    """Look up the set-up and tear-down cost of layers.
+
+    Without costs, every set-up and tear-down costs 1, so that their number
+    is minimised. Layers without a recorded cost are assumed to cost the
+    average of the recorded ones.
+    """
+
+    def __init__(self, costs=None):
+        costs = costs or {}
+        self.default = tuple(
+            _mean([cost[phase] for cost in costs.values() if cost[phase] is not None])
+            for phase in (0, 1)
+        )
+        self.costs = {
+            name: tuple(
+                self.default[phase] if cost[phase] is None else cost[phase]
+                for phase in (0, 1)
+            )
+            for name, cost in costs.items()
+        }
+
+    def setUp(self, layer):
+        return self.costs.get(layerName(layer), self.default)[0]
+
+    def tearDown(self, layer):
+        return self.costs.get(layerName(layer), self.default)[1]
+
+
+def _mean(values):
+    return sum(values) / len(values) if values else 1.0
+
+
+def fixtureCost(order, costs=None, setUpLayers=()):
+    """Return the total cost of setting up and tearing down fixtures when
+    running the layers in ``order`` one after the other.
+
+    Like ``zope.testrunner``, before each layer the layers it does not need
+    are torn down, and the layers it needs are set up, and all layers are
+    torn down at the end. Layers in ``setUpLayers`` are already set up and
+    stay set up, at no cost.
+
+    ``costs`` maps layer names to ``(setUp, tearDown)`` costs, as returned
+    by ``layerCosts()``. Without it, the number of set-ups and tear-downs
+    is returned.
+    """
+    model = _CostModel(costs)
+    kept = set(setUpLayers)
+    current = set()
+    total = 0.0
+    for layer in order:
+        needed = set(neededLayers(layer)) - kept
+        total += sum(model.tearDown(base) for base in current - needed)
+        total += sum(model.setUp(base) for base in needed - current)
+        current = needed
+    total += sum(model.tearDown(base) for base in current)
+    return total
+
+
+def planLayerOrder(layers, costs=None, setUpLayers=()):
+    """Return ``layers`` in an order that keeps the total cost of setting
+    up and tearing down their fixtures low, as measured by
+    ``fixtureCost()``.
+
+    The order is built greedily. The next layer is the one that is cheapest
+    to switch to, where tearing down a base that a layer still to come
+    needs also counts the cost of setting it up again. Ties keep the order
+    of ``layers``. The result is then improved by moving single layers to
+    cheaper positions.
+    """
+    model = _CostModel(costs)
+    kept = set(setUpLayers)
+    needed = {layer: set(neededLayers(layer)) - kept for layer in layers}
+
+    remaining = list(dict.fromkeys(layers))
+    current = set()
+    order = []
+    while remaining:
+        # How many of the remaining layers need each base
+        users = {}
+        for layer in remaining:
+            for base in needed[layer]:
+                users[base] = users.get(base, 0) + 1
+
+        def switchCost(layer):
+            cost = 0.0
+            for base in current - needed[layer]:
+                cost += model.tearDown(base)
+                if users.get(base, 0):
+                    cost += model.setUp(base)
+            for base in needed[layer] - current:
+                cost += model.setUp(base)
+            return cost
+
+        nextLayer = min(remaining, key=switchCost)
+        remaining.remove(nextLayer)
+        order.append(nextLayer)
+        current = needed[nextLayer]
+
+    return _improveOrder(order, costs, setUpLayers)
+
+
+def _improveOrder(order, costs, setUpLayers, maxPasses=3):
+    """Move single layers to other positions in ``order`` for as long as
+    that lowers the cost, for at most ``maxPasses`` passes.
+    """
+    model = _CostModel(costs)
+    kept = set(setUpLayers)
+
+    # Nodes are indexes into ``needed``. The sets at both ends are empty.
+    needed = [set()] + [set(neededLayers(layer)) - kept for layer in order]
+    switch = [
+        [
+            sum(model.tearDown(base) for base in before - after)
+            + sum(model.setUp(base) for base in after - before)
+            for after in needed
+        ]
+        for before in needed
+    ]
+
+    nodes = [0] + list(range(1, len(needed))) + [0]
+    for _ in range(maxPasses):
+        improved = False
+        for index in range(1, len(nodes) - 1):
+            node = nodes[index]
+            previous, following = nodes[index - 1], nodes[index + 1]
+            removed = (
+                switch[previous][following]
+                - switch[previous][node]
+                - switch[node][following]
+            )
+            rest = nodes[:index] + nodes[index + 1 :]
+            for position in range(1, len(rest)):
+                if position == index:
+                    continue
+                before, after = rest[position - 1], rest[position]
+                inserted = (
+                    switch[before][node] + switch[node][after] - switch[before][after]
+                )
+                if removed + inserted < -1e-9:
+                    nodes = rest[:position] + [node] + rest[position:]
+                    improved = True
+                    break
+        if not improved:
+            break
+
+    return [order[node - 1] for node in nodes[1:-1]]
+
+
+def runForked(layer, tests, processes=None, result=None, setUpLayers=None):
+    """Run ``tests`` in ``layer``, sharing one layer set-up between several
+    worker processes.
+
+    The layer and its bases are set up in the current process. Then
+    ``processes`` workers, by default one per CPU, are forked. Each runs
+    every ``processes``-th test, calling ``testSetUp()`` and
+    ``testTearDown()`` of the layer and its bases around each test, and
+    sends the outcomes back. They are added to ``result``, a
+    ``unittest.TestResult`` which is made if not given and returned.
+    Errors and failures are reported as ``WorkerError`` exceptions carrying
+    the traceback from the worker.
+
+    If a dict ``setUpLayers`` is passed, layers already in it are not set
+    up again, and the layers set up are added to it and left set up.
+    Otherwise, they are torn down again at the end.
+
+    Without ``os.fork()``, or with a single process, the tests are run in
+    the current process. Fixtures that start threads, such as servers,
+    are not available in the workers, because forking only copies the
+    calling thread.
+    """
+    if result is None:
+        result = unittest.TestResult()
+    if processes is None:
+        processes = os.cpu_count() or 1
+    processes = max(1, min(processes, len(tests)))
+
+    ownLayers = setUpLayers is None
+    if ownLayers:
+        setUpLayers = {}
+
+    setUpLayer(layer, setUpLayers)
+    try:
+        layers = layerOrder(layer)
+        if processes == 1 or not hasattr(os, "fork"):
+            _runTests(layers, tests, result)
+        else:
+            _runWorkers(layers, tests, processes, result)
+    finally:
+        if ownLayers:
+            tearDownLayers(setUpLayers)
+
+    return result
+
+
+def runLayers(suite, result=None, processes=1, costs=None, setUpLayers=None):
+    """Run the tests in ``suite`` layer by layer, with the layers in the
+    order chosen by ``planLayerOrder()`` for the given ``costs``, and
+    return the ``unittest.TestResult``. The tests of each layer are run
+    with ``runForked()`` and ``processes`` workers. Tests without a layer
+    are run first.
+
+    Before each layer, the layers it does not need are torn down. Layers
+    already in the dict ``setUpLayers`` are kept set up throughout. All
+    other layers are torn down at the end.
+    """
+    if result is None:
+        result = unittest.TestResult()
+    if setUpLayers is None:
+        setUpLayers = {}
+
+    groups = groupByLayer(suite)
+    unittest.BaseTestSuite(groups.pop(None, [])).run(result)
+
+    kept = set(setUpLayers)
+    added = {}
+    try:
+        for layer in planLayerOrder(list(groups), costs, kept):
+            needed = set(neededLayers(layer))
+            unneeded = {base: 1 for base in added if base not in needed}
+            for base in unneeded:
+                del added[base]
+                del setUpLayers[base]
+            tearDownLayers(unneeded)
+
+            runForked(
+                layer,
+                groups[layer],
+                processes=processes,
+                result=result,
+                setUpLayers=setUpLayers,
+            )
+            for base in setUpLayers:
+                if base not in kept:
+                    added[base] = 1
+    finally:
+        for base in added:
+            del setUpLayers[base]
+        tearDownLayers(added)
+
+    return result
+
+
+def _runTests(layers, tests, result):
+    for test in tests:
+        for layer in layers:
+            if hasattr(layer, "testSetUp"):
+                layer.testSetUp()
+        try:
+            test(result)
+        finally:
+            for layer in reversed(layers):
+                if hasattr(layer, "testTearDown"):
+                    layer.testTearDown()
+
+
+def _runWorkers(layers, tests, processes, result):
+    workers = {}
+    for worker in range(processes):
+        indexes = list(range(worker, len(tests), processes))
+        reader, writer = multiprocessing.connection.Pipe(duplex=False)
+
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            # Worker process. Never return into the caller's code.
+            status = 1
+            try:
+                reader.close()
+                for other in workers:
+                    other.close()
+                _runShard(layers, tests, indexes, writer)
+                status = 0
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(status)
+
+        writer.close()
+        workers[reader] = (pid, set(indexes))
+
+    while workers:
+        for reader in multiprocessing.connection.wait(list(workers)):
+            pid, pending = workers[reader]
+            try:
+                index, outcomes = reader.recv()
+            except EOFError:
+                reader.close()
+                del workers[reader]
+                _reapWorker(pid, pending, tests, result)
+            else:
+                pending.discard(index)
+                _replay(tests[index], outcomes, result)
+
+
+def _reapWorker(pid, pending, tests, result):
+    """Wait for a worker to exit and report the tests it did not get to as
+    errors.
+    """
+    status = os.waitstatus_to_exitcode(os.waitpid(pid, 0)[1])
+    for index in sorted(pending):
+        message = f"Worker process {pid} exited with status {status}"
+        _replay(tests[index], [("error", message)], result)
+
+
+def _replay(test, outcomes, result):
+    result.startTest(test)
+    for outcome, detail in outcomes:
+        if outcome == "success":
+            result.addSuccess(test)
+        elif outcome == "error":
+            result.addError(test, (WorkerError, WorkerError(detail), None))
+        elif outcome == "failure":
+            result.addFailure(test, (WorkerError, WorkerError(detail), None))
+        elif outcome == "skip":
+            result.addSkip(test, detail)
+        elif outcome == "expectedFailure":
+            result.addExpectedFailure(test, (WorkerError, WorkerError(detail), None))
+        elif outcome == "unexpectedSuccess":
+            result.addUnexpectedSuccess(test)
+    result.stopTest(test)
+
+
+def _runShard(layers, tests, indexes, connection):
+    """Run the tests at ``indexes`` and send the outcomes of each test to
+    ``connection`` as an ``(index, outcomes)`` pair.
+    """
+    for index in indexes:
+        test = tests[index]
+        shardResult = _ShardResult()
+        try:
+            _runTests(layers, [test], shardResult)
+        except Exception:
+            shardResult.outcomes.append(("error", traceback.format_exc()))
+        connection.send((index, shardResult.outcomes))
+    connection.close()
+
+
+class _ShardResult(unittest.TestResult):
+    """Record the outcomes of a test in a worker as picklable
+    ``(outcome, detail)`` pairs.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.outcomes = []
+
+    def addSuccess(self, test):
+        self.outcomes.append(("success", None))
+
+    def addError(self, test, err):
+        self.outcomes.append(("error", self._exc_info_to_string(err, test)))
+
+    def addFailure(self, test, err):
+        self.outcomes.append(("failure", self._exc_info_to_string(err, test)))
+
+    def addSkip(self, test, reason):
+        self.outcomes.append(("skip", reason))
+
+    def addExpectedFailure(self, test, err):
+        self.outcomes.append(("expectedFailure", self._exc_info_to_string(err, test)))
+
+    def addUnexpectedSuccess(self, test):
+        self.outcomes.append(("unexpectedSuccess", None))
+
+    def addSubTest(self, test, subtest, err):
+        if err is not None:
+            outcome = (
+                "failure" if issubclass(err[0], test.failureException) else "error"
+            )
+            self.outcomes.append(
+                (outcome, f"{subtest}\n{self._exc_info_to_string(err, test)}")
+            )
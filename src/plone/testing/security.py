@@ -2,6 +2,9 @@
 
 from plone.testing import Layer
 
+import itertools
+
+# Stack of (checkers, basic types) copies
 _checkersStack = []
 
 
@@ -12,7 +15,9 @@ def pushCheckers():
     """
     from zope.security import checker
 
-    _checkersStack.append(checker._checkers.copy())
+    # The checkers dict is shared with the C extension of zope.security, so
+    # it has to stay the same object and cannot be replaced by an overlay.
+    _checkersStack.append((checker._checkers.copy(), dict(checker.BasicTypes)))
 
 
 def popCheckers():
@@ -22,8 +27,43 @@ def popCheckers():
     """
     from zope.security import checker
 
-    checker._checkers.clear()
-    checker._checkers.update(_checkersStack.pop())
+    checkers = checker._checkers
+    previous, basicTypes = _checkersStack.pop()
+
+    # Usually, checkers have only been added since the push. Then we just
+    # remove them, which also means that there is no moment at which the
+    # dict is empty. Changed basic types may have replaced existing
+    # checkers, so in that case, and if anything else changed, we restore
+    # the copy.
+    if basicTypes != checker.BasicTypes or not _removeAddedCheckers(checkers, previous):
+        checkers.clear()
+        checkers.update(previous)
+
+
+def _removeAddedCheckers(checkers, previous):
+    """Remove the entries added to ``checkers`` since it was copied to
+    ``previous``. Dicts keep their insertion order, so these are the last
+    entries. Returns ``False`` without changing anything if entries were
+    removed or reordered as well.
+    """
+    added = len(checkers) - len(previous)
+    if added < 0:
+        return False
+
+    newest = itertools.islice(reversed(checkers), added + 1)
+    addedKeys = list(itertools.islice(newest, added))
+    if any(key in previous for key in addedKeys):
+        return False
+
+    # The entry before the added ones must be the newest one in the copy
+    if previous:
+        last = next(reversed(previous))
+        if next(newest, None) is not last or checkers[last] is not previous[last]:
+            return False
+
+    for key in addedKeys:
+        del checkers[key]
+    return True
 
 
 class Checkers(Layer):
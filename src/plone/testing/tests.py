@@ -79,11 +79,17 @@ def test_suite():
         [
             doctest.DocFileSuite(
                 "layer.rst",
+                "instrumentation.rst",
                 "zca.rst",
                 "security.rst",
                 "publisher.rst",
                 "zodb.rst",
                 "zope.rst",
+                "runner.rst",
+                "zygote.rst",
+                "loadtesting.rst",
+                "profiling.rst",
+                "accesslog.rst",
                 setUp=setUp,
                 tearDown=tearDown,
                 optionflags=doctest.ELLIPSIS | doctest.NORMALIZE_WHITESPACE,
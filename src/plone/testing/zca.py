@@ -1,12 +1,27 @@
 """Core Zope Component Architecture helpers and layers"""
 
+from plone.testing import instrumentation
 from plone.testing import Layer
 from zope.configuration.config import ConfigurationMachine
 
+import abc
+import collections
+import collections.abc
+import hashlib
+import io
 import logging
+import os
 
 logger = logging.getLogger("plone.testing.zca")
 
+# Set the environment variable PLONE_TESTING_ZCML_CACHE to reuse the result
+# of parsing the same ZCML in the same state within a test run. See
+# ``loadZCMLFile()``.
+ZCML_CACHE = bool(os.environ.get("PLONE_TESTING_ZCML_CACHE"))
+
+# cache key -> _ZCMLCacheEntry
+_zcmlCache = {}
+
 # Contains a stack of installed global registries (but not the default one)
 _REGISTRIES = []
 
@@ -154,10 +169,23 @@ def popGlobalRegistry():
 
 
 class NamedConfigurationMachine(ConfigurationMachine):
+    # List of (interface, name, factory) directive registrations, while the
+    # ZCML cache records them
+    _registrations = None
+
     def __init__(self, name):
         super().__init__()
         self.__name__ = name
 
+    def register(self, interface, name, factory):
+        if isinstance(self._registry, _StackedMapping) and name in self._registry:
+            # Extend the directive registry of the parent context instead of
+            # changing it
+            self._registry._claim(name)
+        super().register(interface, name, factory)
+        if self._registrations is not None:
+            self._registrations.append((interface, name, factory))
+
     def __str__(self):
         pkg = "zope.configuration.config.ConfigurationMachine"
         return "<{} object {}>".format(
@@ -175,10 +203,144 @@ def stackConfigurationContext(context=None, name="not named"):
     configuration context is returned.
     """
 
+    with instrumentation.traced("stackConfigurationContext", "zcml", name=name):
+        return _stackConfigurationContext(context, name)
+
+
+class _StackedSet(collections.abc.MutableSet):
+    """A set that shares the items of a parent set and only records its own
+    additions and removals.
+    """
+
+    def __init__(self, parent):
+        self._parent = parent
+        self._added = set()
+        self._removed = set()
+
+    def __contains__(self, item):
+        if item in self._added:
+            return True
+        return item not in self._removed and item in self._parent
+
+    def __iter__(self):
+        yield from self._added
+        for item in self._parent:
+            if item not in self._added and item not in self._removed:
+                yield item
+
+    def __len__(self):
+        return sum(1 for item in self)
+
+    def add(self, item):
+        self._removed.discard(item)
+        self._added.add(item)
+
+    def discard(self, item):
+        self._added.discard(item)
+        if item in self._parent:
+            self._removed.add(item)
+
+
+class _StackedMapping(collections.abc.MutableMapping):
+    """A mapping that shares the items of a parent mapping. Looking up a
+    value returns the parent's. ``setdefault()`` and ``_claim()``, used
+    where the value is about to be changed, first replace it by the result
+    of ``_copy()``, so that the parent is not affected.
+    """
+
+    def __init__(self, parent):
+        self._parent = parent
+        self._own = {}
+        self._removed = set()
+
+    @abc.abstractmethod
+    def _copy(self, value):
+        """Return a copy of the parent's ``value`` that can be changed."""
+
+    def __contains__(self, key):
+        if key in self._own:
+            return True
+        return key not in self._removed and key in self._parent
+
+    def __getitem__(self, key):
+        return self._peek(key)
+
+    def _claim(self, key):
+        # Return the value of ``key`` after copying it from the parent, if it
+        # is not our own yet
+        try:
+            return self._own[key]
+        except KeyError:
+            pass
+        value = self._own[key] = self._copy(self._peek(key))
+        return value
+
+    def setdefault(self, key, default=None):
+        if key in self:
+            return self._claim(key)
+        self[key] = default
+        return default
+
+    def _peek(self, key):
+        # Look up a value without copying it into any level of the stack
+        try:
+            return self._own[key]
+        except KeyError:
+            pass
+        if key in self._removed:
+            raise KeyError(key)
+        if isinstance(self._parent, _StackedMapping):
+            return self._parent._peek(key)
+        return self._parent[key]
+
+    def __setitem__(self, key, value):
+        self._removed.discard(key)
+        self._own[key] = value
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self._own.pop(key, None)
+        if key in self._parent:
+            self._removed.add(key)
+
+    def __iter__(self):
+        yield from self._own
+        for key in self._parent:
+            if key not in self._own and key not in self._removed:
+                yield key
+
+    def __len__(self):
+        return sum(1 for key in self)
+
+
+class _StackedDirectiveRegistry(_StackedMapping):
+    """The directive registry of a stacked configuration context. Directive
+    registries are extended rather than copied.
+    """
+
+    def _copy(self, registry):
+        from zope.interface.adapter import AdapterRegistry
+
+        return AdapterRegistry(bases=(registry,))
+
+
+class _StackedI18nStrings(_StackedMapping):
+    """The message ids recorded by a stacked configuration context. The
+    strings of a domain are copied when they are first looked up, as
+    ``zope.configuration`` only looks them up to add to them.
+    """
+
+    def __getitem__(self, key):
+        return self._claim(key)
+
+    def _copy(self, strings):
+        return {msgid: list(locations) for msgid, locations in strings.items()}
+
+
+def _stackConfigurationContext(context, name):
     from copy import deepcopy
     from zope.configuration.xmlconfig import registerCommonDirectives
-    from zope.interface import Interface
-    from zope.interface.adapter import AdapterRegistry
 
     clone = NamedConfigurationMachine(name)
 
@@ -191,41 +353,200 @@ def stackConfigurationContext(context=None, name="not named"):
         logger.debug("New configuration context %s", clone)
         return clone
 
-    # Copy over simple attributes
+    # Share the state of the parent context where possible, and only keep
+    # what the clone changes. The parent context must not change while the
+    # clone is in use, which holds for layers.
+
     clone.info = deepcopy(context.info)
-    clone.i18n_strings = deepcopy(context.i18n_strings)
-    clone.package = deepcopy(context.package)
-    clone.basepath = deepcopy(context.basepath)
-    clone.includepath = deepcopy(context.includepath)
+    clone.package = context.package
+    clone.basepath = context.basepath
+    clone.includepath = context.includepath
 
-    clone._seen_files = deepcopy(context._seen_files)
-    clone._features = deepcopy(context._features)
+    clone.i18n_strings = _StackedI18nStrings(context.i18n_strings)
+    clone._seen_files = _StackedSet(context._seen_files)
+    clone._features = _StackedSet(context._features)
 
     try:
-        clone.permission_mapping = deepcopy(context.permission_mapping)
+        parentMapping = context.permission_mapping
     except AttributeError:
         pass
+    else:
+        if isinstance(parentMapping, collections.ChainMap):
+            clone.permission_mapping = parentMapping.new_child()
+        else:
+            clone.permission_mapping = collections.ChainMap({}, parentMapping)
 
     # Note: We don't copy ``stack`` or ``actions`` since these are used during
     # ZCML file processing only
 
-    # Copy over documentation registry
-    clone._docRegistry = [tuple(list(entry)) for entry in context._docRegistry]
+    # Entries of the documentation registry are immutable tuples
+    clone._docRegistry = list(context._docRegistry)
 
-    # Copy over the directive registry
-    for key, registry in context._registry.items():
-        newRegistry = clone._registry.setdefault(key, AdapterRegistry())
-        for adapterRegistration in registry._adapters:
-            if adapterRegistration not in newRegistry._adapters:
-                for interface, info in adapterRegistration.items():
-                    if Interface in info:
-                        factory = info[Interface][""]
-                        newRegistry.register([interface], Interface, "", factory)
+    clone._registry = _StackedDirectiveRegistry(context._registry)
 
     logger.debug("Configuration context %s cloned from %s", clone, context)
     return clone
 
 
+def loadZCMLFile(filename, package=None, context=None):
+    """Load the ZCML file ``filename`` from ``package`` into the
+    configuration context ``context`` and execute the resulting actions, like
+    ``zope.configuration.xmlconfig.file()``.
+
+    If ``ZCML_CACHE`` is true (set the environment variable
+    ``PLONE_TESTING_ZCML_CACHE``) and ``context`` comes from
+    ``stackConfigurationContext()``, the effects of parsing the file are
+    recorded. Loading the same file into a context in the same state later
+    in the test run replays them instead of parsing the file and its
+    includes again, as long as none of the files have changed.
+    """
+
+    from zope.configuration import xmlconfig
+
+    if context is None:
+        return xmlconfig.file(filename, package)  # noqa: D001
+
+    source = ("file", filename, getattr(package, "__name__", package))
+    return _loadZCML(
+        context, source, lambda: xmlconfig.include(context, filename, package)
+    )
+
+
+def loadZCMLString(s, context=None, name="<string>"):
+    """Load the ZCML in the string ``s`` into the configuration context
+    ``context`` and execute the resulting actions, like
+    ``zope.configuration.xmlconfig.string()``. Uses the ZCML cache like
+    ``loadZCMLFile()``.
+    """
+
+    from zope.configuration import xmlconfig
+
+    if context is None:
+        return xmlconfig.string(s, name=name)
+
+    def parse():
+        f = io.BytesIO(s) if isinstance(s, bytes) else io.StringIO(s)
+        f.name = name
+        xmlconfig.processxmlfile(f, context)
+
+    content = s if isinstance(s, bytes) else s.encode("utf-8")
+    source = ("string", hashlib.sha256(content).hexdigest(), name)
+    return _loadZCML(context, source, parse)
+
+
+def clearZCMLCache():
+    """Forget everything recorded by the ZCML cache."""
+    _zcmlCache.clear()
+
+
+class _ZCMLCacheEntry:
+    """The effects of parsing some ZCML on the configuration context."""
+
+    def __init__(self):
+        self.files = {}
+        self.registrations = []
+        self.documentation = []
+        self.seenFiles = set()
+        self.features = set()
+        self.permissions = {}
+        self.actions = []
+
+    def isCurrent(self):
+        for path, digest in self.files.items():
+            try:
+                if _hashFile(path) != digest:
+                    return False
+            except OSError:
+                return False
+        return True
+
+    def replay(self, context):
+        for interface, name, factory in self.registrations:
+            context.register(interface, name, factory)
+        context._docRegistry.extend(self.documentation)
+        context._seen_files |= self.seenFiles
+        context._features |= self.features
+        context.permission_mapping.update(self.permissions)
+        context.actions.extend(dict(action) for action in self.actions)
+
+
+def _hashFile(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def _loadZCML(context, source, parse):
+    if not ZCML_CACHE or not isinstance(context, NamedConfigurationMachine):
+        parse()
+        context.execute_actions()
+        return context
+
+    if not hasattr(context, "permission_mapping"):
+        context.permission_mapping = {}
+
+    # Parsing depends on the files already included, the features provided
+    # and the directives known
+    package = getattr(context.package, "__name__", context.package)
+    key = (
+        source,
+        package,
+        context.basepath,
+        context.includepath,
+        frozenset(context._seen_files),
+        frozenset(context._features),
+        frozenset(context._registry),
+    )
+
+    entry = _zcmlCache.get(key)
+    if entry is not None and entry.isCurrent():
+        logger.debug("Replaying cached ZCML %s", source)
+        entry.replay(context)
+    else:
+        entry = _recordZCML(context, parse)
+        _zcmlCache[key] = entry
+
+    context.execute_actions()
+    return context
+
+
+def _recordZCML(context, parse):
+    entry = _ZCMLCacheEntry()
+
+    seenFiles = context._seen_files
+    features = context._features
+    permissions = context.permission_mapping
+    nActions = len(context.actions)
+    nDocumentation = len(context._docRegistry)
+
+    # Record additions in overlays, and merge them in afterwards
+    context._seen_files = _StackedSet(seenFiles)
+    context._features = _StackedSet(features)
+    context.permission_mapping = collections.ChainMap({}, permissions)
+    context._registrations = entry.registrations
+    try:
+        parse()
+    finally:
+        entry.seenFiles = context._seen_files._added
+        entry.features = context._features._added
+        entry.permissions = context.permission_mapping.maps[0]
+
+        context._seen_files = seenFiles
+        context._features = features
+        context.permission_mapping = permissions
+        del context._registrations
+
+        seenFiles |= entry.seenFiles
+        features |= entry.features
+        permissions.update(entry.permissions)
+
+    entry.documentation = context._docRegistry[nDocumentation:]
+    entry.actions = [dict(action) for action in context.actions[nActions:]]
+    entry.files = {
+        path: _hashFile(path) for path in entry.seenFiles if os.path.isfile(path)
+    }
+    return entry
+
+
 # Layers
 
 
@@ -301,16 +622,12 @@ class ZCMLDirectives(Layer):
     defaultBases = (LAYER_CLEANUP,)
 
     def setUp(self):
-        from zope.configuration import xmlconfig
-
         import zope.component
 
         self["configurationContext"] = context = stackConfigurationContext(
             self.get("configurationContext")
         )
-        # D001 requests to use self.loadZCML instead of xmlconfig.file but
-        # loadZCML is defined in `plone.app.testing` and cannot be used here.
-        xmlconfig.file("meta.zcml", zope.component, context=context)  # noqa: D001
+        loadZCMLFile("meta.zcml", zope.component, context=context)
 
     def tearDown(self):
         del self["configurationContext"]
@@ -347,11 +664,10 @@ class ZCMLSandbox(Layer):
         self.loadZCMLFile(self.filename, self.package)
 
     def loadZCMLFile(self, filename, package):
-        from zope.configuration import xmlconfig
-
-        xmlconfig.file(
-            filename, package, context=self["configurationContext"]
-        )  # noqa: D001,E501
+        with instrumentation.traced(
+            filename, "zcml", package=getattr(package, "__name__", package)
+        ):
+            loadZCMLFile(filename, package, context=self["configurationContext"])
 
     def tearDown(self):
         popGlobalRegistry()
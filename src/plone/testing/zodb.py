@@ -1,12 +1,31 @@
 """ZODB-specific helpers and layers"""
 
+from plone.testing import instrumentation
 from plone.testing import Layer
 
+import hashlib
+import os
+import pickle
+import tempfile
 
-def stackDemoStorage(db=None, name=None):
+
+def stackDemoStorage(db=None, name=None, resettable=False, flatten=False, count=None):
     """Create a new DemoStorage that has the given database as a base.
     ``db`` may be none, in which case a base demo storage will be created.
-    ``name`` is optional, but can be used to name the storage.
+    ``name`` is optional, but can be used to name the storage. If
+    ``resettable`` is true, a ``ResettableDemoStorage`` is used.
+
+    If ``flatten`` is true, the changes of all ``DemoStorage`` storages
+    stacked in ``db`` are copied into a single in-memory storage, so that
+    loading an object does not have to go through every level of the stack.
+    Changes committed to ``db`` afterwards are not seen by the new database.
+    Blobs are not copied.
+
+    If ``count`` is true, the new storage is wrapped in a
+    ``CountingStorage``. By default, it is if the storage of ``db`` is, or if
+    ZODB counters are enabled in ``plone.testing.instrumentation``.
+
+    The new database has the same connection pool size as ``db``.
 
     The usual pattern in a layer is::
 
@@ -21,12 +40,498 @@ def stackDemoStorage(db=None, name=None):
     from ZODB.DB import DB
     from ZODB.DemoStorage import DemoStorage
 
+    factory = ResettableDemoStorage if resettable else DemoStorage
+
+    if count is None:
+        count = instrumentation.isZODBCountingEnabled() or (
+            db is not None and isinstance(db.storage, CountingStorage)
+        )
+
+    poolSize = 7
     if db is not None:
-        storage = DemoStorage(name=name, base=db.storage)
+        poolSize = db.getPoolSize()
+        base = db.storage
+        if isinstance(base, CountingStorage):
+            # Loads through the new storage are counted there
+            base = base.storage
+        if flatten:
+            base = flattenDemoStorage(base)
+        storage = factory(name=name, base=base)
     else:
-        storage = DemoStorage(name=name)
+        storage = factory(name=name)
+
+    if count:
+        storage = CountingStorage(storage)
+
+    return DB(storage, pool_size=poolSize)
+
+
+class StorageCounters:
+    """Number of objects and bytes loaded from and stored in a storage."""
+
+    def __init__(self):
+        self.loads = 0
+        self.stores = 0
+        self.bytesLoaded = 0
+        self.bytesStored = 0
+
+    def __repr__(self):
+        return (
+            f"<StorageCounters loads={self.loads} stores={self.stores} "
+            f"bytesLoaded={self.bytesLoaded} bytesStored={self.bytesStored}>"
+        )
+
+
+class CountingStorage:
+    """Wrap a storage to count the objects loaded from and stored in it.
+
+    Every object a connection loads is a miss in its object cache, so the
+    number of loads is also the number of cache misses. All other attributes
+    are those of the wrapped storage, which is available as ``storage``.
+
+    ``counters`` counts everything since the wrapper was created.
+    ``record()`` starts a new set of counters, for example for a single
+    test.
+    """
+
+    def __init__(self, storage):
+        from zope.interface import directlyProvides
+        from zope.interface import providedBy
+
+        self.storage = storage
+        self.counters = StorageCounters()
+        self._recorders = [self.counters]
+
+        # Keep blob and undo support visible to the database
+        directlyProvides(self, providedBy(storage))
+
+    def __getattr__(self, name):
+        return getattr(self.storage, name)
+
+    def __repr__(self):
+        return repr(self.storage)
+
+    def __len__(self):
+        return len(self.storage)
+
+    def record(self):
+        """Return new ``StorageCounters`` that count from now on, until
+        passed to ``stopRecording()``.
+        """
+        counters = StorageCounters()
+        self._recorders.append(counters)
+        return counters
+
+    def stopRecording(self, counters):
+        self._recorders.remove(counters)
+
+    def _loaded(self, data):
+        if data is not None:
+            for counters in self._recorders:
+                counters.loads += 1
+                counters.bytesLoaded += len(data)
+
+    def _stored(self, data):
+        for counters in self._recorders:
+            counters.stores += 1
+            counters.bytesStored += len(data) if data is not None else 0
+
+    def load(self, oid, *args):
+        result = self.storage.load(oid, *args)
+        self._loaded(result[0])
+        return result
+
+    def loadBefore(self, oid, tid):
+        result = self.storage.loadBefore(oid, tid)
+        if result is not None:
+            self._loaded(result[0])
+        return result
+
+    def loadSerial(self, oid, serial):
+        data = self.storage.loadSerial(oid, serial)
+        self._loaded(data)
+        return data
+
+    def store(self, oid, serial, data, version, transaction):
+        result = self.storage.store(oid, serial, data, version, transaction)
+        self._stored(data)
+        return result
+
+    def storeBlob(self, oid, serial, data, blobfilename, version, transaction):
+        result = self.storage.storeBlob(
+            oid, serial, data, blobfilename, version, transaction
+        )
+        self._stored(data)
+        return result
+
+
+def startCounting(layer):
+    """Call from ``testSetUp()`` after the test's database is in place. If
+    its storage is a ``CountingStorage``, counters for the test are made
+    available as the resource ``zodbCounters`` and returned.
+    """
+
+    storage = layer["zodbDB"].storage
+    if not isinstance(storage, CountingStorage):
+        return None
+
+    layer["zodbCounters"] = counters = storage.record()
+    return counters
+
+
+def stopCounting(layer, counters):
+    """Call from ``testTearDown()`` with the result of ``startCounting()``,
+    while the test's database is still in place. Adds the counters to the
+    report of ``plone.testing.instrumentation``.
+    """
+
+    if counters is None:
+        return
+
+    layer["zodbDB"].storage.stopRecording(counters)
+    instrumentation.addZODBCounters(layer, counters)
+    del layer["zodbCounters"]
+
+
+def flattenDemoStorage(storage):
+    """Return a ``DemoStorage`` with the same current data as ``storage``,
+    whose changes are the changes of every ``DemoStorage`` stacked in
+    ``storage``, squashed into a single ``MappingStorage``. Its base is the
+    storage at the bottom of the stack, which is shared, not copied.
+    History and blobs are not copied. Stacks with fewer than two levels are
+    returned as they are.
+    """
 
-    return DB(storage)
+    from ZODB.Connection import TransactionMetaData
+    from ZODB.DemoStorage import DemoStorage
+    from ZODB.MappingStorage import MappingStorage
+    from ZODB.utils import z64
+
+    levels, bottom = _demoStorageLevels(storage)
+    if len(levels) < 2:
+        return storage  # Nothing to gain
+
+    records = _currentRecords(levels)
+
+    flattened = MappingStorage(f"{storage.getName()} (flattened)")
+    if records:
+        txn = TransactionMetaData(description="Flatten DemoStorage stack")
+        flattened.tpc_begin(txn)
+        for oid, data in sorted(records.items()):
+            flattened.store(oid, z64, data, "", txn)
+        flattened.tpc_vote(txn)
+        flattened.tpc_finish(txn)
+
+    return DemoStorage(
+        name=flattened.getName(),
+        base=bottom,
+        changes=flattened,
+        close_base_on_close=False,
+    )
+
+
+def _demoStorageLevels(storage):
+    """Return the changes of each ``DemoStorage`` stacked in ``storage``,
+    from the top down, and the storage at the bottom of the stack.
+    """
+
+    from ZODB.DemoStorage import DemoStorage
+
+    levels = []
+    bottom = storage
+    while isinstance(bottom, DemoStorage):
+        levels.append(bottom.changes)
+        bottom = bottom.base
+    return levels, bottom
+
+
+def _currentRecords(levels):
+    """Return a dict of the current data of each object in the changes
+    ``levels``, as returned by ``_demoStorageLevels()``.
+    """
+
+    # Replay the changes from the bottom up, so that the topmost record for
+    # each object wins
+    records = {}
+    for changes in reversed(levels):
+        for txn in changes.iterator():
+            for record in txn:
+                if record.data is None:
+                    records.pop(record.oid, None)
+                else:
+                    records[record.oid] = record.data
+    return records
+
+
+try:
+    from ZODB.DemoStorage import DemoStorage as _DemoStorage
+except ImportError:  # ZODB is an optional dependency
+    ResettableDemoStorage = None
+else:
+
+    class ResettableDemoStorage(_DemoStorage):
+        """A ``DemoStorage`` that can roll its committed state back to an
+        earlier checkpoint.
+
+        Rolling back commits a transaction restoring the previous state of
+        every object changed since the checkpoint, so the cost is
+        proportional to the number of changed objects. Objects created
+        after the checkpoint are left behind, unreachable. The database is
+        told about the changes, so connection caches stay warm for
+        everything else.
+        """
+
+        _db = None
+
+        def registerDB(self, db):
+            self._db = db
+
+        def checkpoint(self):
+            """Return a marker for the current state, to be passed to
+            ``rollback()``.
+            """
+            return self.lastTransaction()
+
+        def rollback(self, checkpoint):
+            """Restore the state at the time ``checkpoint()`` returned
+            ``checkpoint``. Returns the number of objects restored.
+            """
+            from ZODB.Connection import TransactionMetaData
+            from ZODB.POSException import POSKeyError
+            from ZODB.utils import load_current
+            from ZODB.utils import p64
+            from ZODB.utils import u64
+
+            after = p64(u64(checkpoint) + 1)
+
+            changed = set()
+            for txn in self.changes.iterator(after):
+                for record in txn:
+                    changed.add(record.oid)
+
+            reverts = []
+            for oid in sorted(changed):
+                try:
+                    previous = self.loadBefore(oid, after)
+                except POSKeyError:
+                    previous = None
+                if previous is None or previous[0] is None:
+                    continue  # created after the checkpoint
+                reverts.append((oid, previous[0]))
+
+            if not reverts:
+                return 0
+
+            txn = TransactionMetaData(description="Roll back to checkpoint")
+            self.tpc_begin(txn)
+            try:
+                for oid, data in reverts:
+                    self.store(oid, load_current(self, oid)[1], data, "", txn)
+                self.tpc_vote(txn)
+            except BaseException:
+                self.tpc_abort(txn)
+                raise
+            tid = self.tpc_finish(txn)
+
+            if self._db is not None:
+                self._db.invalidate(tid, {oid for oid, data in reverts})
+
+            return len(reverts)
+
+
+def fingerprint(*paths):
+    """Return a hex digest of the contents of the given files. Directories
+    are walked recursively. This is useful to build the cache key of a
+    ``CachedFixture`` from the code and ZCML that set up its content.
+    """
+
+    digest = hashlib.sha256()
+    for path in paths:
+        if os.path.isdir(path):
+            files = []
+            for dirpath, dirnames, filenames in os.walk(path):
+                dirnames[:] = sorted(d for d in dirnames if d != "__pycache__")
+                files.extend(
+                    os.path.join(dirpath, f)
+                    for f in sorted(filenames)
+                    if not f.endswith((".pyc", ".pyo"))
+                )
+        else:
+            files = [path]
+
+        for filename in files:
+            digest.update(os.fsencode(os.path.relpath(filename, path)))
+            with open(filename, "rb") as f:
+                digest.update(f.read())
+
+    return digest.hexdigest()
+
+
+def dumpSnapshot(db, path, key):
+    """Write the current content of every ``DemoStorage`` stacked in the
+    storage of ``db``, as created by ``stackDemoStorage()``, to the file
+    ``path``, tagged with the cache key ``key``. Blobs are not included.
+
+    The content of the bases is included, because a ``DemoStorage`` picks
+    random object ids. Objects created by the bases in a later run have
+    different ids, so changes to them could not be restored on their own.
+    """
+
+    storage = db.storage
+    if isinstance(storage, CountingStorage):
+        storage = storage.storage
+    levels, bottom = _demoStorageLevels(storage)
+    records = sorted(_currentRecords(levels).items())
+
+    # Write to a temporary file first so that an interrupted run does not
+    # leave a truncated snapshot behind
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tempPath = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        pickle.dump({"key": key, "records": records}, f, pickle.HIGHEST_PROTOCOL)
+    os.replace(tempPath, path)
+
+
+def restoreSnapshot(db, path, key):
+    """Load a snapshot written by ``dumpSnapshot()`` into ``db``, which
+    should be a fresh database from ``stackDemoStorage()``. Returns ``False``
+    without touching the database if there is no snapshot at ``path``, if it
+    was written for a different cache key, or if it refers to objects that
+    neither it nor the database holds.
+    """
+
+    from ZODB.Connection import TransactionMetaData
+    from ZODB.POSException import POSKeyError
+    from ZODB.serialize import referencesf
+    from ZODB.utils import load_current
+    from ZODB.utils import z64
+
+    try:
+        with open(path, "rb") as f:
+            snapshot = pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return False
+
+    if snapshot.get("key") != key:
+        return False
+
+    storage = db.storage
+
+    # References to objects outside the snapshot must resolve in the
+    # database, e.g. to objects in a storage at the bottom of the stack
+    oids = {oid for oid, data in snapshot["records"]}
+    for oid, data in snapshot["records"]:
+        for reference in referencesf(data):
+            if reference in oids:
+                continue
+            try:
+                load_current(storage, reference)
+            except POSKeyError:
+                return False
+            oids.add(reference)
+
+    txn = TransactionMetaData(description=f"Restore snapshot {path}")
+    storage.tpc_begin(txn)
+    try:
+        for oid, data in snapshot["records"]:
+            try:
+                serial = load_current(storage, oid)[1]
+            except POSKeyError:
+                serial = z64
+            storage.store(oid, serial, data, "", txn)
+        storage.tpc_vote(txn)
+    except BaseException:
+        storage.tpc_abort(txn)
+        raise
+    storage.tpc_finish(txn)
+
+    # The database has loaded the root object when it was opened. Make sure
+    # connections see the restored state instead.
+    db.cacheMinimize()
+    return True
+
+
+class CachedFixture(Layer):
+    """Base class for a fixture layer whose ZODB content is cached on disk
+    between test runs.
+
+    The layer stacks a ``DemoStorage`` on top of the ``zodbDB`` resource of
+    its bases. Subclasses override ``setUpContent()`` to create persistent
+    content in it, and ``setUpEnvironment()`` and ``tearDownEnvironment()``
+    for everything else (ZCML, products, patches), which has to run every
+    time.
+
+    If ``cacheDirectory`` is set (it defaults to the environment variable
+    ``PLONE_TESTING_FIXTURE_CACHE``) and ``cacheKey()`` returns a string, the
+    database content is written to that directory after
+    ``setUpContent()``. Later runs with the same key restore it instead of
+    calling ``setUpContent()``. The key must change whenever the content
+    would, including changes to the bases; ``fingerprint()`` helps with
+    that. The snapshot includes the content stacked by the bases, since its
+    object ids differ between runs. If it refers to objects the database
+    does not hold, ``setUpContent()`` is called after all.
+    """
+
+    cacheDirectory = os.environ.get("PLONE_TESTING_FIXTURE_CACHE")
+
+    # Set after set-up to tell whether the content came from the cache
+    snapshotRestored = False
+
+    def setUp(self):
+        self["zodbDB"] = db = stackDemoStorage(self.get("zodbDB"), name=self.__name__)
+        self.setUpEnvironment()
+
+        key = self.cacheKey()
+        path = self.snapshotPath()
+        if path is None or key is None:
+            self.snapshotRestored = False
+            self.setUpContent(db)
+        elif restoreSnapshot(db, path, key):
+            self.snapshotRestored = True
+        else:
+            self.snapshotRestored = False
+            self.setUpContent(db)
+            os.makedirs(self.cacheDirectory, exist_ok=True)
+            dumpSnapshot(db, path, key)
+
+    def tearDown(self):
+        self.tearDownEnvironment()
+        self["zodbDB"].close()
+        del self["zodbDB"]
+
+    def snapshotPath(self):
+        """Return the path of the snapshot file, or ``None`` if caching is
+        disabled.
+        """
+        if not self.cacheDirectory:
+            return None
+        return os.path.join(
+            self.cacheDirectory, f"{self.__module__}.{self.__name__}.snapshot"
+        )
+
+    # Template methods for use in subclasses
+
+    def cacheKey(self):
+        """Return a string identifying the content ``setUpContent()`` would
+        create, or ``None`` to disable caching.
+        """
+        return None
+
+    def setUpEnvironment(self):
+        """Set up non-persistent state. Called on every set-up, before
+        ``setUpContent()`` or restoring the snapshot.
+        """
+        pass
+
+    def tearDownEnvironment(self):
+        """Tear down what ``setUpEnvironment()`` set up."""
+        pass
+
+    def setUpContent(self, db):
+        """Create persistent content in ``db``. Not called when the content
+        was restored from the cache.
+        """
+        pass
 
 
 class EmptyZODB(Layer):
@@ -48,13 +553,17 @@ class EmptyZODB(Layer):
     defaultBases = ()
 
     def setUp(self):
-        self["zodbDB"] = self.createDatabase(self.createStorage())
+        storage = self.createStorage()
+        if instrumentation.isZODBCountingEnabled():
+            storage = CountingStorage(storage)
+        self["zodbDB"] = self.createDatabase(storage)
 
     def tearDown(self):
         self["zodbDB"].close()
         del self["zodbDB"]
 
     def testSetUp(self):
+        self._zodbCounters = startCounting(self)
         self["zodbConnection"] = connection = self["zodbDB"].open()
         self["zodbRoot"] = connection.root()
 
@@ -67,6 +576,7 @@ class EmptyZODB(Layer):
 
         transaction.abort()
 
+        stopCounting(self, self._zodbCounters)
         self["zodbConnection"].close()
 
         del self["zodbConnection"]
@@ -1,26 +1,37 @@
 """Zope-specific helpers and layers using WSGI"""
 
+from io import BytesIO
 from OFS.metaconfigure import get_packages_to_initialize
+from plone.testing import instrumentation
 from plone.testing import Layer
 from plone.testing import zca
 from plone.testing import zodb
 from plone.testing._z2_testbrowser import Browser  # noqa
+from plone.testing.accesslog import AccessLog
+from plone.testing.accesslog import AccessLogMiddleware
 from webtest.http import StopableWSGIServer
 from Zope2.App.schema import Zope2VocabularyRegistry
 from zope.schema.vocabulary import getVocabularyRegistry
 from zope.schema.vocabulary import setVocabularyRegistry
 
+import atexit
 import contextlib
 import os
 import shutil
 import sys
 import tempfile
+import threading
 import transaction
+import warnings
 import Zope2.Startup.run
+import zope.component
 import ZPublisher.WSGIPublisher
 
 _INSTALLED_PRODUCTS = {}
 
+# See _productIndex()
+_PRODUCT_INDEX = None
+
 PY3_10 = sys.version_info[0:2] >= (3, 10)
 
 
@@ -28,6 +39,30 @@ class TestIsolationBroken(BaseException):
     pass
 
 
+def _productIndex():
+    """Return a dict mapping dotted names of products in the ``Products``
+    namespace to their ``get_products()`` entries. The file system is only
+    scanned the first time until ``_resetProductIndex()`` is called, which
+    the ``STARTUP`` layer does on set-up and tear-down.
+    """
+    global _PRODUCT_INDEX
+
+    if _PRODUCT_INDEX is None:
+        from OFS.Application import get_products
+
+        index = {}
+        for product in get_products():
+            index.setdefault("Products." + product[1], product)
+        _PRODUCT_INDEX = index
+
+    return _PRODUCT_INDEX
+
+
+def _resetProductIndex():
+    global _PRODUCT_INDEX
+    _PRODUCT_INDEX = None
+
+
 def installProduct(app, productName, quiet=False, multiinit=False):
     """Install the Zope 2 product with the given name, so that it will show
     up in the Zope 2 control panel and have its ``initialize()`` hook called.
@@ -40,106 +75,116 @@ def installProduct(app, productName, quiet=False, multiinit=False):
     Note that products' ZCML is *not* loaded automatically, even if the
     product is in the Products namespace.
     """
+    installProducts(app, [productName], quiet=quiet, multiinit=multiinit)
+
+
+def installProducts(app, productNames, quiet=False, multiinit=False):
+    """Install the Zope 2 products with the given names, in order. This is
+    the same as calling ``installProduct()`` for each of them, but looks
+    them all up in one pass.
+    """
     from AccessControl.class_init import InitializeClass
     from OFS.Application import get_folder_permissions
-    from OFS.Application import get_products
     from OFS.Application import install_package
     from OFS.Application import install_product
     from OFS.Folder import Folder
 
     import sys
 
-    found = False
-
-    if productName in _INSTALLED_PRODUCTS:
-        return
+    products = _productIndex()
+    packages = None
 
-    if productName.startswith("Products."):
-        # get_products will find all Products.  But when everything is
-        # installed with pip, it may only find items in the
-        # lib/python3.x/site-packages/Products directory,
-        # and miss source checkouts.  So we may need a second chance later
-        # when calling get_packages_to_initialize.
-        for priority, name, index, productDir in get_products():
-            if ("Products." + name) == productName:
-                install_product(
-                    app, productDir, name, [], get_folder_permissions(), raise_exc=1
-                )
-                InitializeClass(Folder)
+    for productName in productNames:
+        if productName in _INSTALLED_PRODUCTS:
+            continue
 
-                _INSTALLED_PRODUCTS[productName] = (
-                    priority,
-                    name,
-                    index,
-                    productDir,
-                )
+        found = False
 
-                found = True
-                break
-
-    if not found:
-        # All non-Products packages, plus any Products that are not yet found.
-        packages = tuple(get_packages_to_initialize())
-        for module, init_func in packages:
-            if module.__name__ == productName:
+        # The product index will find all Products. But when everything is
+        # installed with pip, it may only find items in the
+        # lib/python3.x/site-packages/Products directory, and miss source
+        # checkouts. So we may need a second chance with the packages to
+        # initialize.
+        product = products.get(productName)
+        if product is not None:
+            priority, name, index, productDir = product
+            install_product(
+                app, productDir, name, [], get_folder_permissions(), raise_exc=1
+            )
+            InitializeClass(Folder)
+
+            _INSTALLED_PRODUCTS[productName] = product
+            found = True
+
+        if not found:
+            # All non-Products packages, plus any Products that are not yet
+            # found. Installing a package removes it from this list, so
+            # index a copy.
+            if packages is None:
+                packages = {}
+                for module, init_func in tuple(get_packages_to_initialize()):
+                    packages.setdefault(module.__name__, []).append((module, init_func))
+
+            candidates = packages.pop(productName, [])
+            if candidates and not multiinit:
+                candidates = candidates[:1]
+            for module, init_func in candidates:
                 install_package(app, module, init_func, raise_exc=1)
                 _INSTALLED_PRODUCTS[productName] = (
                     module,
                     init_func,
                 )
-
                 found = True
-                if not multiinit:
-                    break
 
-    if not found and not quiet:
-        sys.stderr.write(f"Could not install product {productName}\n")
-        sys.stderr.flush()
+        if not found and not quiet:
+            sys.stderr.write(f"Could not install product {productName}\n")
+            sys.stderr.flush()
 
 
-def uninstallProduct(app, productName, quiet=False):
+def uninstallProduct(app, productName, quiet=None):
     """Uninstall the given Zope 2 product. This is the inverse of
-    ``installProduct()`` above.
+    ``installProduct()`` above. Products that are not installed are
+    skipped. ``quiet`` is deprecated, as there is nothing to report.
     """
+    if quiet is not None:
+        warnings.warn(
+            "The quiet argument of uninstallProduct() has no effect and will"
+            " be removed.",
+            DeprecationWarning,
+            stacklevel=2,
+        )
+    uninstallProducts(app, [productName])
 
-    from OFS.Application import Application
-    from OFS.Application import get_products
 
-    import sys
+def uninstallProducts(app, productNames):
+    """Uninstall the given Zope 2 products. This is the inverse of
+    ``installProducts()`` above. Products that are not installed are
+    skipped.
+    """
 
-    # from OFS.Folder import Folder
-    # from OFS.Application import get_folder_permissions
-    # from AccessControl.class_init import InitializeClass
-    found = False
+    from OFS.Application import Application
 
-    if productName not in _INSTALLED_PRODUCTS:
-        return
+    products = _productIndex()
 
-    if productName.startswith("Products."):
-        for priority, name, index, productDir in get_products():
-            if ("Products." + name) == productName:
-                if name in Application.misc_.__dict__:
-                    delattr(Application.misc_, name)
+    for productName in productNames:
+        if productName not in _INSTALLED_PRODUCTS:
+            continue
 
-                # TODO: Also remove permissions from get_folder_permissions?
-                # Difficult to know if this would stomp on any other
-                # permissions
-                # InitializeClass(Folder)
+        product = products.get(productName)
+        if product is not None:
+            name = product[1]
+            if name in Application.misc_.__dict__:
+                delattr(Application.misc_, name)
 
-                found = True
-                break
-    if not found and productName in _INSTALLED_PRODUCTS:  # must be a package
-        if productName in Application.misc_.__dict__:
+            # TODO: Also remove permissions from get_folder_permissions?
+            # Difficult to know if this would stomp on any other
+            # permissions
+            # InitializeClass(Folder)
+        elif productName in Application.misc_.__dict__:  # must be a package
             delattr(Application.misc_, productName)
-        found = True
 
-    if found:
         del _INSTALLED_PRODUCTS[productName]
 
-    if not found and not quiet:
-        sys.stderr.write(f"Could not uninstall product {productName}\n")
-        sys.stderr.flush()
-
 
 def login(userFolder, userName):
     """Log in as the given user in the given user folder."""
@@ -197,16 +242,95 @@ def makeTestRequest(environ=None):
     return req
 
 
-def addRequestContainer(app, environ=None):
+class RequestFactory:
+    """Make requests like ``makeTestRequest()`` by copying a prototype.
+
+    The environment is sanitised, the server URL computed and the default
+    skin looked up once, when the prototype is made. Calling the factory
+    returns a new request with its own environment, form, response and
+    other mutable state. The prototype is remade if the adapter registry of
+    the current site manager changes, so a changed default skin is picked
+    up. If the registry does not tell when it changed, each request is made
+    with ``makeTestRequest()``.
+    """
+
+    def __init__(self, environ=None):
+        self.environ = dict(environ or {})
+        self._prototype = None
+        self._adapters = None
+        self._generation = None
+
+    def __call__(self):
+        adapters = zope.component.getSiteManager().adapters
+        # zope.interface counts the changes to an adapter registry in the
+        # private attribute ``_generation``. Without it, a prototype could
+        # be out of date, so make each request from scratch.
+        generation = getattr(adapters, "_generation", None)
+        if generation is None:
+            return makeTestRequest(dict(self.environ))
+        if self._adapters is not adapters or self._generation != generation:
+            self._makePrototype()
+            self._adapters = adapters
+            self._generation = generation
+
+        prototype = self._prototype
+
+        response = self._responseClass.__new__(self._responseClass)
+        state = response.__dict__
+        state.update(prototype.response.__dict__)
+        for name in self._responseContainers:
+            state[name] = state[name].copy()
+        response.stdout = BytesIO()
+        response.stderr = BytesIO()
+
+        request = self._requestClass.__new__(self._requestClass)
+        state = request.__dict__
+        state.update(prototype.__dict__)
+        for name in self._requestContainers:
+            state[name] = state[name].copy()
+        request._debug = self._debugClass()
+        request.response = response
+        request.other["RESPONSE"] = response
+
+        return request
+
+    def _makePrototype(self):
+        prototype = self._prototype = makeTestRequest(dict(self.environ))
+        self._requestClass = prototype.__class__
+        self._requestContainers = _containerNames(prototype)
+        self._responseClass = prototype.response.__class__
+        self._responseContainers = _containerNames(prototype.response)
+        self._debugClass = prototype._debug.__class__
+
+
+def _containerNames(obj):
+    """Return the names of the attributes of ``obj`` that hold a dict or a
+    list, which need to be copied for each request.
+    """
+    return tuple(
+        name for name, value in obj.__dict__.items() if type(value) in (dict, list)
+    )
+
+
+# Used by addRequestContainer() when no environment is given
+_DEFAULT_REQUEST_FACTORY = RequestFactory()
+
+
+def addRequestContainer(app, environ=None, request=None):
     """Add the request container with a fake request to the app object's
     acquisition context and return the wrapped app object. Additional request
-    environment values can be passed as a dict ``environ``.
+    environment values can be passed as a dict ``environ``. Alternatively,
+    pass a ``request``, e.g. one made by a ``RequestFactory``.
     """
 
     from ZPublisher.BaseRequest import RequestContainer
 
-    req = makeTestRequest(environ)
-    requestcontainer = RequestContainer(REQUEST=req)
+    if request is None:
+        if environ is None:
+            request = _DEFAULT_REQUEST_FACTORY()
+        else:
+            request = makeTestRequest(environ)
+    requestcontainer = RequestContainer(REQUEST=request)
     return app.__of__(requestcontainer)
 
 
@@ -302,28 +426,40 @@ class Startup(Layer):
     # Layer lifecycle
 
     def setUp(self):
-        self.setUpDebugMode()
-        self.setUpClientCache()
-        self.setUpPatches()
-        self.setUpThreads()
-        self.setUpHostPort()
-        self.setUpDatabase()
-        self.setUpApp()
-        self.setUpBasicProducts()
-        self.setUpZCML()
-        self.setUpFive()
+        self._runPhases(
+            "setUpDebugMode",
+            "setUpClientCache",
+            "setUpPatches",
+            "setUpThreads",
+            "setUpHostPort",
+            "setUpDatabase",
+            "setUpApp",
+            "setUpBasicProducts",
+            "setUpZCML",
+            "setUpFive",
+        )
 
     def tearDown(self):
-        self.tearDownFive()
-        self.tearDownZCML()
-        self.tearDownBasicProducts()
-        self.tearDownApp()
-        self.tearDownDatabase()
-        self.tearDownHostPort()
-        self.tearDownThreads()
-        self.tearDownPatches()
-        self.tearDownClientCache()
-        self.tearDownDebugMode()
+        self._runPhases(
+            "tearDownFive",
+            "tearDownZCML",
+            "tearDownBasicProducts",
+            "tearDownApp",
+            "tearDownDatabase",
+            "tearDownHostPort",
+            "tearDownThreads",
+            "tearDownPatches",
+            "tearDownClientCache",
+            "tearDownDebugMode",
+        )
+
+    def _runPhases(self, *phases):
+        """Call the named helper methods in order, timing each of them as
+        a separate phase when instrumentation is enabled.
+        """
+        for phase in phases:
+            with instrumentation.timed(self, phase):
+                getattr(self, phase)()
 
     # Layer lifecycle helper methods
 
@@ -596,16 +732,19 @@ class Startup(Layer):
     def setUpBasicProducts(self):
         """Install a minimal set of products required for Zope 2."""
 
+        # Look for products again, once
+        _resetProductIndex()
+
         with zopeApp() as app:
-            installProduct(app, "Products.PluginIndexes")
-            installProduct(app, "Products.OFSP")
+            installProducts(app, ["Products.PluginIndexes", "Products.OFSP"])
 
     def tearDownBasicProducts(self):
         """Tear down the minimal set of products"""
 
         with zopeApp() as app:
-            uninstallProduct(app, "Products.PluginIndexes")
-            uninstallProduct(app, "Products.OFSP")
+            uninstallProducts(app, ["Products.PluginIndexes", "Products.OFSP"])
+
+        _resetProductIndex()
 
         # It's possible for Five's _register_monkies and _meta_type_regs
         # global variables to contain duplicates. This causes an unnecessary
@@ -637,9 +776,7 @@ class Startup(Layer):
             self.get("configurationContext")
         )
 
-        from zope.configuration import xmlconfig
-
-        xmlconfig.string(
+        zca.loadZCMLString(
             """\
 <configure
     xmlns="http://namespaces.zope.org/zope"
@@ -714,23 +851,51 @@ class IntegrationTesting(Layer):
 
         MY_FIXTURE = MyFixture(bases=(zope.STARTUP,), name='MyFixture')
         MY_INTEGRATION_TESTING = zope.IntegrationTesting(bases=(MY_FIXTURE,), name='MyFixture:Integration')  # noqa
+
+    Set ``reuseConnection`` to true in a subclass to keep using the same
+    database connection for all tests of the layer. Aborting the transaction
+    after each test invalidates the objects it changed, and everything else
+    stays in the connection's cache for the next test.
     """
 
     defaultBases = (STARTUP,)
 
+    reuseConnection = False
+
+    _connection = None
+
+    # Made on first use, see ``RequestFactory``
+    _requestFactory = None
+
+    # Layer lifecycle
+
+    def tearDown(self):
+        self._requestFactory = None
+        if self._connection is not None:
+            transaction.abort()
+            self._connection.close()
+            del self._connection
+
     # Test lifecycle
 
     def testSetUp(self):
         import Zope2
 
+        self._zodbCounters = zodb.startCounting(self)
+
         # Open a new app and save it as the resource ``app``.
 
-        environ = {
-            "SERVER_NAME": self["host"],
-            "SERVER_PORT": str(self["port"]),
-        }
+        if self._requestFactory is None:
+            self._requestFactory = RequestFactory(
+                {
+                    "SERVER_NAME": self["host"],
+                    "SERVER_PORT": str(self["port"]),
+                }
+            )
 
-        app = addRequestContainer(Zope2.app(), environ=environ)
+        app = addRequestContainer(
+            Zope2.app(self._testConnection()), request=self._requestFactory()
+        )
         request = app.REQUEST
         request["PARENTS"] = [app]
 
@@ -777,12 +942,25 @@ here and let you fix it.""")
         # Close the database connection and the request
         app = self["app"]
         app.REQUEST.close()
-        app._p_jar.close()
+        if not self.reuseConnection:
+            app._p_jar.close()
 
         # Delete the resources
         del self["request"]
         del self["app"]
 
+        zodb.stopCounting(self, self._zodbCounters)
+
+    def _testConnection(self):
+        """Return the connection to open the app with, or ``None`` for a
+        new one.
+        """
+        if not self.reuseConnection:
+            return None
+        if self._connection is None:
+            self._connection = self["zodbDB"].open()
+        return self._connection
+
 
 INTEGRATION_TESTING = IntegrationTesting()
 
@@ -809,31 +987,56 @@ class FunctionalTesting(Layer):
 
         MY_FIXTURE = MyFixture(bases=(zope.STARTUP,), name='MyFixture')
         MY_FUNCTIONAL_TESTING = zope.FunctionalTesting(bases=(MY_FIXTURE,), name='MyFixture:Functional')  # noqa
+
+    Set ``isolation`` to ``"rollback"`` in a subclass to keep a single
+    database for the whole layer instead, and roll back whatever a test
+    committed on test tear-down. This keeps the connection cache warm
+    between tests.
     """
 
     defaultBases = (STARTUP,)
 
+    # Either "demostorage" for a new database per test, or "rollback"
+    isolation = "demostorage"
+
+    # Made on first use, see ``RequestFactory``
+    _requestFactory = None
+
+    # Layer lifecycle
+
+    def setUp(self):
+        if self.isolation == "rollback":
+            self["zodbDB"] = zodb.stackDemoStorage(
+                self.get("zodbDB"), name="FunctionalTest", resettable=True
+            )
+        elif self.isolation != "demostorage":
+            raise ValueError(f"Unknown isolation mode {self.isolation!r}")
+
+    def tearDown(self):
+        self._requestFactory = None
+        if self.isolation == "rollback":
+            self["zodbDB"].close()
+            del self["zodbDB"]
+
     # Test lifecycle
 
     def testSetUp(self):
         import Zope2
 
-        # Override zodbDB from the layer setup. Since it was set up by
-        # this layer, we can't just assign a new shadow. We therefore keep
-        # track of the original so that we can restore it on tear-down.
-
-        self["zodbDB"] = zodb.stackDemoStorage(
-            self.get("zodbDB"), name="FunctionalTest"
-        )
+        self._pushTestDatabase()
+        self._zodbCounters = zodb.startCounting(self)
 
         # Save the app
 
-        environ = {
-            "SERVER_NAME": self["host"],
-            "SERVER_PORT": str(self["port"]),
-        }
+        if self._requestFactory is None:
+            self._requestFactory = RequestFactory(
+                {
+                    "SERVER_NAME": self["host"],
+                    "SERVER_PORT": str(self["port"]),
+                }
+            )
 
-        app = addRequestContainer(Zope2.app(), environ=environ)
+        app = addRequestContainer(Zope2.app(), request=self._requestFactory())
         request = app.REQUEST
         request["PARENTS"] = [app]
 
@@ -872,9 +1075,30 @@ class FunctionalTesting(Layer):
         del self["app"]
         del self["request"]
 
-        # Close and discard the database
-        self["zodbDB"].close()
-        del self["zodbDB"]
+        zodb.stopCounting(self, self._zodbCounters)
+        self._popTestDatabase()
+
+    def _pushTestDatabase(self):
+        if self.isolation == "rollback":
+            # Remember where to roll back to
+            self._checkpoint = self["zodbDB"].storage.checkpoint()
+        else:
+            # Override zodbDB from the layer setup. Since it was set up by
+            # this layer, we can't just assign a new shadow. We therefore
+            # keep track of the original so that we can restore it on
+            # tear-down.
+            self["zodbDB"] = zodb.stackDemoStorage(
+                self.get("zodbDB"), name="FunctionalTest"
+            )
+
+    def _popTestDatabase(self):
+        if self.isolation == "rollback":
+            self["zodbDB"].storage.rollback(self._checkpoint)
+            del self._checkpoint
+        else:
+            # Close and discard the database
+            self["zodbDB"].close()
+            del self["zodbDB"]
 
 
 FUNCTIONAL_TESTING = FunctionalTesting()
@@ -882,6 +1106,92 @@ FUNCTIONAL_TESTING = FunctionalTesting()
 WSGI_LOG_REQUEST = "WSGI_REQUEST_LOGGING" in os.environ
 
 
+class _LazyApp:
+    """A WSGI application that is made by calling ``factory()`` when the
+    first request comes in.
+    """
+
+    def __init__(self, factory):
+        self.factory = factory
+        self.app = None
+        self._lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        app = self.app
+        if app is None:
+            with self._lock:
+                app = self.app
+                if app is None:
+                    app = self.app = self.factory()
+        return app(environ, start_response)
+
+
+class _SwitchableApp:
+    """The WSGI application of a pooled server. It passes requests on to the
+    application of the layer using the server, if any.
+    """
+
+    app = None
+
+    def __call__(self, environ, start_response):
+        app = self.app
+        if app is None:
+            start_response("503 Service Unavailable", [("Content-Type", "text/plain")])
+            return [b"No layer is using this server"]
+        return app(environ, start_response)
+
+
+class _PooledServer:
+    """A server kept running between the layers using it."""
+
+    def __init__(self, options):
+        self.options = options
+        self.app = _SwitchableApp()
+        self.server = StopableWSGIServer.create(self.app, **options)
+        self.confDir = tempfile.mkdtemp()
+        # The Zope configuration made for the server
+        self.configuration = None
+
+    def matches(self, options):
+        """Whether the server can be used by a layer with the given server
+        options.
+        """
+        for name, value in options.items():
+            if name == "host":
+                if value in ("0.0.0.0", "127.0.0.1", "localhost"):
+                    value = "localhost"
+                if value != self.server.effective_host:
+                    return False
+            elif name == "port":
+                if value != int(self.server.effective_port):
+                    return False
+            elif self.options.get(name) != value:
+                return False
+        for name in self.options:
+            if name not in ("host", "port") and name not in options:
+                return False
+        return True
+
+    def shutdown(self):
+        self.server.shutdown()
+        shutil.rmtree(self.confDir, ignore_errors=True)
+
+
+# Idle servers of ``WSGIServer`` layers with ``pooled`` set
+_serverPool = []
+
+
+def shutDownServerPool():
+    """Stop the idle servers kept by ``WSGIServer`` layers with ``pooled``
+    set. This is done when the process exits.
+    """
+    while _serverPool:
+        _serverPool.pop().shutdown()
+
+
+atexit.register(shutDownServerPool)
+
+
 class WSGIServer(Layer):
     """Start a WSGI server that accesses the fixture managed by the
     ``STARTUP`` layer.
@@ -892,6 +1202,45 @@ class WSGIServer(Layer):
     The ``WSGI_SERVER_FIXTURE`` layer must be used as the base for a layer that
     uses the ``FunctionalTesting`` layer class. The ``WSGI_SERVER`` layer is
     an example of such a layer.
+
+    If ``lazy`` is true, or the environment variable ``WSGI_SERVER_LAZY``
+    is set, Zope is only configured for the server and the WSGI application
+    made when the first request comes in. Only the application is lazy: the
+    server is still started on set-up, so that the ``host`` and ``port``
+    resources can be used right away. How often the application was made or
+    not is recorded in the report of ``plone.testing.instrumentation``.
+
+    ``threads``, ``backlog`` and ``channelTimeout`` set the number of worker
+    threads, the connection backlog and the seconds after which an idle
+    connection is closed, respectively. They default to the environment
+    variables ``WSGI_SERVER_THREADS``, ``WSGI_SERVER_BACKLOG`` and
+    ``WSGI_SERVER_CHANNEL_TIMEOUT``, or to the defaults of ``waitress``. Each
+    request opens its own ZODB connection, and the connection pool of the
+    database is made big enough for one connection per worker thread.
+
+    If ``profileDirectory``, or the environment variable
+    ``WSGI_SERVER_PROFILE``, is set, the requests are profiled by a
+    ``plone.testing.profiling.ProfilingMiddleware`` around the Zope
+    publisher, available as ``self.profiler``. Every
+    ``profileSampleEvery``-th request of each URL pattern is profiled, and
+    the statistics of each pattern are written to a ``.pstats`` file in the
+    directory when the server is stopped. ``profilePatterns`` is a list of
+    ``(name, regular expression)`` tuples to group URLs by.
+
+    The requests served are recorded in a
+    ``plone.testing.accesslog.AccessLog``, available as the resource
+    ``accessLog``. It keeps the last ``accessLogSize`` requests, by default
+    the value of the environment variable ``WSGI_SERVER_ACCESS_LOG_SIZE`` or
+    1000, and a histogram of the latencies of all of them. If
+    ``accessLogFile``, or the environment variable ``WSGI_SERVER_ACCESS_LOG``,
+    is set, the log is saved to that file as JSON on tear-down.
+
+    If ``pooled`` is true, or the environment variable ``WSGI_SERVER_POOL``
+    is set, the server is not stopped on tear-down, but kept in a pool for
+    the next ``WSGIServer`` layer with the same options. That layer only
+    points the server at its own application, which it makes lazily if
+    ``lazy`` is set. The servers in the pool are stopped by
+    ``shutDownServerPool()``, or when the process exits.
     """
 
     defaultBases = (STARTUP,)
@@ -899,29 +1248,81 @@ class WSGIServer(Layer):
     timeout = 5
     host = os.environ.get("WSGI_SERVER_HOST", os.environ.get("ZSERVER_HOST"))
     port = os.environ.get("WSGI_SERVER_PORT", os.environ.get("ZSERVER_PORT"))
+    lazy = bool(os.environ.get("WSGI_SERVER_LAZY"))
+    threads = os.environ.get("WSGI_SERVER_THREADS")
+    backlog = os.environ.get("WSGI_SERVER_BACKLOG")
+    channelTimeout = os.environ.get("WSGI_SERVER_CHANNEL_TIMEOUT")
+    pooled = bool(os.environ.get("WSGI_SERVER_POOL"))
+    profileDirectory = os.environ.get("WSGI_SERVER_PROFILE")
+    profileSampleEvery = os.environ.get("WSGI_SERVER_PROFILE_SAMPLE", 1)
+    profilePatterns = ()
+    accessLogSize = int(os.environ.get("WSGI_SERVER_ACCESS_LOG_SIZE", 1000))
+    accessLogFile = os.environ.get("WSGI_SERVER_ACCESS_LOG")
     pipeline = [
         ("Zope", "paste.filter_app_factory", "httpexceptions", {}),
     ]
 
+    server = None
+    profiler = None
+
     def setUp(self):
+        self.setUpPoolSize()
+        self.setUpAccessLog()
         self["host"] = self.host
         self.setUpServer()
         self["port"] = self.port
 
     def tearDown(self):
+        if self.lazy:
+            instrumentation.addServerStart(self, self._lazyApp.app is not None)
         self.tearDownServer()
+        self.server = None
         del self["host"]
         del self["port"]
+        self.tearDownAccessLog()
+        self.tearDownPoolSize()
+
+    def setUpPoolSize(self):
+        """Make the connection pool of the database at least as big as the
+        number of worker threads. Databases stacked on it later, such as the
+        one of each functional test, take over the pool size.
+        """
+        self._poolSize = None
+        if self.threads is None:
+            return
+        db = self["zodbDB"]
+        if db.getPoolSize() < int(self.threads):
+            self._poolSize = db.getPoolSize()
+            db.setPoolSize(int(self.threads))
+
+    def tearDownPoolSize(self):
+        """Restore the pool size of the database."""
+        poolSize = self.__dict__.pop("_poolSize", None)
+        if poolSize is not None:
+            self["zodbDB"].setPoolSize(poolSize)
+
+    def setUpAccessLog(self):
+        """Create the access log and save it as the resource ``accessLog``."""
+        self["accessLog"] = AccessLog(self.accessLogSize)
+
+    def tearDownAccessLog(self):
+        """Save the access log to ``accessLogFile``, if set, and pop the
+        resource.
+        """
+        accessLog = self.get("accessLog")
+        if accessLog is None:
+            return
+        if self.accessLogFile:
+            accessLog.dump(self.accessLogFile)
+        del self["accessLog"]
 
     def setUpServer(self):
         """Create a WSGI server instance and save it in self.server."""
-        app = self.make_wsgi_app()
-        kwargs = {"clear_untrusted_proxy_headers": False}
-        if self.host is not None:
-            kwargs["host"] = self.host
-        if self.port is not None:
-            kwargs["port"] = int(self.port)
-        self.server = StopableWSGIServer.create(app, **kwargs)
+        if self.pooled:
+            self.server = self._takePooledServer()
+        else:
+            app = self._loggedApp(self.make_wsgi_app)
+            self.server = StopableWSGIServer.create(app, **self._serverOptions())
         # If we dynamically set the host/port, we want to reset it to localhost
         # Otherwise this will depend on, for example, the local network setup
         if self.host in (None, "0.0.0.0", "127.0.0.1", "localhost"):
@@ -932,18 +1333,107 @@ class WSGIServer(Layer):
 
     def tearDownServer(self):
         """Close the server socket and clean up."""
-        self.server.shutdown()
+        if self.pooled:
+            self._releasePooledServer()
+        else:
+            self.server.shutdown()
+        if self.profiler is not None:
+            self.profiler.dump()
+            self.profiler = None
+        if self.pooled or self.lazy and self._lazyApp.app is None:
+            return
         try:
             shutil.rmtree(self._wsgi_conf_dir)
         except OSError:
             pass
 
+    def _serverOptions(self):
+        kwargs = {"clear_untrusted_proxy_headers": False}
+        if self.host is not None:
+            kwargs["host"] = self.host
+        if self.port is not None:
+            kwargs["port"] = int(self.port)
+        if self.threads is not None:
+            kwargs["threads"] = int(self.threads)
+        if self.backlog is not None:
+            kwargs["backlog"] = int(self.backlog)
+        if self.channelTimeout is not None:
+            kwargs["channel_timeout"] = int(self.channelTimeout)
+        return kwargs
+
+    def _takePooledServer(self):
+        """Take an idle server with the same options from the pool, or start
+        a new one, and point it at the application of this layer.
+        """
+        import App.config
+
+        options = self._serverOptions()
+        for pooled in _serverPool:
+            if pooled.matches(options):
+                _serverPool.remove(pooled)
+                break
+        else:
+            pooled = _PooledServer(options)
+        self._pooledServer = pooled
+
+        def makeApp():
+            # Zope only needs configuring again if something, such as the
+            # ``STARTUP`` layer being set up again, changed its configuration.
+            global_config = {"here": pooled.confDir}
+            if App.config.getConfiguration() is not pooled.configuration:
+                zope_conf = self._get_zope_conf(pooled.confDir)
+                Zope2.Startup.run.make_wsgi_app(global_config, zope_conf)
+                pooled.configuration = App.config.getConfiguration()
+            return self.wrap_wsgi_app(
+                ZPublisher.WSGIPublisher.publish_module, global_config
+            )
+
+        pooled.app.app = self._loggedApp(makeApp)
+        return pooled.server
+
+    def _releasePooledServer(self):
+        """Put the server back into the pool."""
+        self._pooledServer.app.app = None
+        _serverPool.append(self._pooledServer)
+        del self._pooledServer
+
+    def _loggedApp(self, makeApp):
+        """Return the application made by ``makeApp()``, recording its
+        requests in the access log, if there is one. In lazy mode, it is only
+        made when the first request comes in.
+        """
+        if self.lazy:
+            app = self._lazyApp = _LazyApp(makeApp)
+        else:
+            app = makeApp()
+        accessLog = self.get("accessLog")
+        if accessLog is None:
+            # A subclass set the server up without setUpAccessLog()
+            return app
+        return AccessLogMiddleware(app, accessLog)
+
     def make_wsgi_app(self):
         self._wsgi_conf_dir = tempfile.mkdtemp()
         global_config = {"here": self._wsgi_conf_dir}
         zope_conf = self._get_zope_conf(self._wsgi_conf_dir)
         Zope2.Startup.run.make_wsgi_app(global_config, zope_conf)
-        app = ZPublisher.WSGIPublisher.publish_module
+        return self.wrap_wsgi_app(
+            ZPublisher.WSGIPublisher.publish_module, global_config
+        )
+
+    def wrap_wsgi_app(self, app, global_config):
+        """Wrap the Zope publisher ``app`` in the profiler, if enabled, and
+        the filters of ``pipeline``.
+        """
+        if self.profileDirectory:
+            from plone.testing.profiling import ProfilingMiddleware
+
+            app = self.profiler = ProfilingMiddleware(
+                app,
+                self.profileDirectory,
+                sampleEvery=self.profileSampleEvery,
+                patterns=self.profilePatterns,
+            )
 
         if not PY3_10:
             return self._handle_entry_points_39(app, global_config)
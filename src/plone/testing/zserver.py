@@ -4,16 +4,21 @@ from plone.testing import Layer
 from plone.testing import zodb
 from plone.testing import zope
 from plone.testing._z2_testbrowser import Browser  # noqa
+from plone.testing.accesslog import AccessLog
 from plone.testing.zope import addRequestContainer
-from plone.testing.zope import installProduct
+from plone.testing.zope import installProduct  # noqa
+from plone.testing.zope import installProducts
 from plone.testing.zope import login  # noqa
 from plone.testing.zope import logout  # noqa
+from plone.testing.zope import RequestFactory
 from plone.testing.zope import setRoles  # noqa
 from plone.testing.zope import TestIsolationBroken
-from plone.testing.zope import uninstallProduct
+from plone.testing.zope import uninstallProduct  # noqa
+from plone.testing.zope import uninstallProducts
 
 import contextlib
 import os
+import time
 import transaction
 
 
@@ -192,16 +197,18 @@ class Startup(zope.Startup):
     def setUpBasicProducts(self):
         """Install a minimal set of products required for Zope 2."""
 
+        zope._resetProductIndex()
+
         with zopeApp() as app:
-            installProduct(app, "Products.PluginIndexes")
-            installProduct(app, "Products.OFSP")
+            installProducts(app, ["Products.PluginIndexes", "Products.OFSP"])
 
     def tearDownBasicProducts(self):
         """Tear down the minimal set of products"""
 
         with zopeApp() as app:
-            uninstallProduct(app, "Products.PluginIndexes")
-            uninstallProduct(app, "Products.OFSP")
+            uninstallProducts(app, ["Products.PluginIndexes", "Products.OFSP"])
+
+        zope._resetProductIndex()
 
         # It's possible for Five's _register_monkies and _meta_type_regs
         # global variables to contain duplicates. This causes an unnecessary
@@ -253,14 +260,21 @@ class IntegrationTesting(zope.IntegrationTesting):
     def testSetUp(self):
         from ZServer import Zope2
 
+        self._zodbCounters = zodb.startCounting(self)
+
         # Open a new app and save it as the resource ``app``.
 
-        environ = {
-            "SERVER_NAME": self["host"],
-            "SERVER_PORT": str(self["port"]),
-        }
+        if self._requestFactory is None:
+            self._requestFactory = RequestFactory(
+                {
+                    "SERVER_NAME": self["host"],
+                    "SERVER_PORT": str(self["port"]),
+                }
+            )
 
-        app = addRequestContainer(Zope2.app(), environ=environ)
+        app = addRequestContainer(
+            Zope2.app(self._testConnection()), request=self._requestFactory()
+        )
         request = app.REQUEST
         request["PARENTS"] = [app]
 
@@ -323,22 +337,20 @@ class FunctionalTesting(zope.FunctionalTesting):
     def testSetUp(self):
         from ZServer import Zope2
 
-        # Override zodbDB from the layer setup. Since it was set up by
-        # this layer, we can't just assign a new shadow. We therefore keep
-        # track of the original so that we can restore it on tear-down.
-
-        self["zodbDB"] = zodb.stackDemoStorage(
-            self.get("zodbDB"), name="FunctionalTest"
-        )
+        self._pushTestDatabase()
+        self._zodbCounters = zodb.startCounting(self)
 
         # Save the app
 
-        environ = {
-            "SERVER_NAME": self["host"],
-            "SERVER_PORT": str(self["port"]),
-        }
+        if self._requestFactory is None:
+            self._requestFactory = RequestFactory(
+                {
+                    "SERVER_NAME": self["host"],
+                    "SERVER_PORT": str(self["port"]),
+                }
+            )
 
-        app = addRequestContainer(Zope2.app(), environ=environ)
+        app = addRequestContainer(Zope2.app(), request=self._requestFactory())
         request = app.REQUEST
         request["PARENTS"] = [app]
 
@@ -377,6 +389,15 @@ class ZServer(Layer):
     The ``ZSERVER_FIXTURE`` layer must be used as the base for a layer that
     uses the ``FunctionalTesting`` layer class. The ``ZSERVER`` layer is
     an example of such a layer.
+
+    The requests served are recorded in a
+    ``plone.testing.accesslog.AccessLog``, available as the resource
+    ``accessLog``. It keeps the last ``accessLogSize`` requests, by default
+    the value of the environment variable ``ZSERVER_ACCESS_LOG_SIZE`` or
+    1000, and a histogram of the latencies of all of them. If
+    ``accessLogFile``, or the environment variable ``ZSERVER_ACCESS_LOG``, is
+    set, the log is saved to that file as JSON on tear-down. The plain text
+    log of the server is only kept if ``log`` is set to a file.
     """
 
     defaultBases = (STARTUP,)
@@ -385,18 +406,30 @@ class ZServer(Layer):
     port = int(os.environ.get("ZSERVER_PORT", 0))
     timeout = 5.0
     log = None
+    accessLogSize = int(os.environ.get("ZSERVER_ACCESS_LOG_SIZE", 1000))
+    accessLogFile = os.environ.get("ZSERVER_ACCESS_LOG")
 
     def setUp(self):
+        from threading import Event
         from threading import Thread
 
-        import time
-
+        self["accessLog"] = AccessLog(self.accessLogSize)
         self["host"] = self.host
         self["port"] = self.port
 
         self._shutdown = False
+        self._ready = Event()
+        self._wakeUp = _makeWakeUp()
 
-        self.setUpServer()
+        try:
+            self.setUpServer()
+        except BaseException:
+            self._wakeUp.close()
+            del self._wakeUp
+            del self["host"]
+            del self["port"]
+            del self["accessLog"]
+            raise
 
         self.thread = Thread(
             name=f"{self.__name__} server",
@@ -404,30 +437,35 @@ class ZServer(Layer):
         )
 
         self.thread.start()
-        time.sleep(0.5)
+        if not self._ready.wait(self.timeout):
+            self.tearDown()
+            raise RuntimeError(f"ZServer did not start within {self.timeout} seconds")
 
     def tearDown(self):
-        import time
-
         self._shutdown = True
+        self._wakeUp.wake()
         self.thread.join(self.timeout)
-        time.sleep(0.5)
+        self._wakeUp.close()
+        del self._wakeUp
 
         self.tearDownServer()
 
         del self["host"]
         del self["port"]
 
+        if self.accessLogFile:
+            self["accessLog"].dump(self.accessLogFile)
+        del self["accessLog"]
+
     def setUpServer(self):
         """Create a ZServer server instance and save it in self.zserver"""
-        from StringIO import StringIO
         from ZServer import logger
         from ZServer import zhttp_handler
         from ZServer import zhttp_server
 
         log = self.log
         if log is None:
-            log = StringIO()
+            log = _DiscardingFile()
 
         zopeLog = logger.file_logger(log)
 
@@ -451,6 +489,14 @@ class ZServer(Layer):
         self["port"] = self.port = server.server_port
 
         zhttpHandler = zhttp_handler(module="Zope2", uri_base="")
+        handleRequest = zhttpHandler.handle_request
+        accessLog = self["accessLog"]
+
+        def handle_request(request):
+            _recordRequest(request, accessLog)
+            return handleRequest(request)
+
+        zhttpHandler.handle_request = handle_request
         server.install_handler(zhttpHandler)
 
         self.zserver = server
@@ -464,16 +510,91 @@ class ZServer(Layer):
     def runner(self):
         """Thread runner for the main asyncore loop. This function runs in a
         separate thread.
+
+        The servers set up by ``setUpServer()`` are listening by the time the
+        loop starts, which is signalled to ``setUp()``. ``tearDown()`` wakes
+        the loop up to stop it, instead of waiting for the poll to time out.
         """
 
         import asyncore
 
+        self._ready.set()
+
         # Poll
         socket_map = asyncore.socket_map
         while socket_map and not self._shutdown:
             asyncore.poll(self.timeout, socket_map)
 
 
+def _makeWakeUp():
+    """Return a dispatcher in the asyncore socket map whose ``wake()`` method
+    makes a running ``asyncore.poll()`` return.
+    """
+    import asyncore
+    import socket
+
+    class WakeUp(asyncore.dispatcher):
+        def __init__(self):
+            reader, self._writer = socket.socketpair()
+            asyncore.dispatcher.__init__(self, reader)
+
+        def readable(self):
+            return True
+
+        def writable(self):
+            return False
+
+        def handle_read(self):
+            try:
+                self.recv(8192)
+            except OSError:
+                pass
+
+        def wake(self):
+            try:
+                self._writer.send(b"x")
+            except OSError:
+                pass
+
+        def close(self):
+            asyncore.dispatcher.close(self)
+            self._writer.close()
+
+    return WakeUp()
+
+
+class _DiscardingFile:
+    """Stands in for the log file of a server whose log is not kept."""
+
+    def write(self, data):
+        pass
+
+    def flush(self):
+        pass
+
+
+def _recordRequest(request, accessLog):
+    """Record a medusa ``request`` in ``accessLog`` once it is done.
+
+    Medusa calls the ``log()`` method of a request with the number of bytes
+    sent when the response is complete.
+    """
+    started = time.perf_counter()
+    log = request.log
+
+    def logRequest(bytes):
+        accessLog.record(
+            request.command.upper(),
+            request.split_uri()[0],
+            request.reply_code,
+            bytes,
+            time.perf_counter() - started,
+        )
+        log(bytes)
+
+    request.log = logRequest
+
+
 # Fixture layer - use as a base layer, but don't use directly, as it has no
 # test lifecycle
 ZSERVER_FIXTURE = ZServer()
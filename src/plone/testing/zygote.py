@@ -0,0 +1,291 @@
+"""A process that keeps layers set up between test runs
+
+While working on a handful of tests, most of each run is spent setting up
+the same fixture, e.g. starting Zope in ``plone.testing.zope.STARTUP``. A
+zygote sets the fixture up once and then waits on a Unix socket. For each
+run request it forks a child, which imports the requested tests afresh and
+runs them in the already set-up layers, writing its output to the socket.
+
+Start a zygote, with the ``STARTUP`` layer and optionally further layers
+set up, in one shell::
+
+    python -m plone.testing.zygote serve /tmp/zygote.sock \\
+        --layer my.package.testing.MY_FIXTURE
+
+And run tests through it from another::
+
+    python -m plone.testing.zygote run /tmp/zygote.sock \\
+        my.package.tests.test_views
+
+Changes to the test modules are picked up by the next run, because the
+zygote never imports them. Changes to the code of the set-up layers, and to
+anything imported while setting them up, need a restart of the zygote.
+"""
+
+from plone.testing import runner
+
+import argparse
+import codecs
+import importlib
+import json
+import os
+import socket
+import sys
+import unittest
+
+DEFAULT_LAYERS = ("plone.testing.zope.STARTUP",)
+
+
+class Zygote:
+    """Set up ``layers`` and serve run requests on the Unix socket at
+    ``socketPath``.
+    """
+
+    def __init__(self, socketPath, layers):
+        self.socketPath = socketPath
+        self.layers = list(layers)
+        self.setUpLayers = {}
+        self._socket = None
+
+    def setUp(self):
+        for layer in self.layers:
+            runner.setUpLayer(layer, self.setUpLayers)
+
+        if os.path.exists(self.socketPath):
+            os.unlink(self.socketPath)
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.bind(self.socketPath)
+        self._socket.listen()
+
+    def tearDown(self):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+            if os.path.exists(self.socketPath):
+                os.unlink(self.socketPath)
+        runner.tearDownLayers(self.setUpLayers)
+
+    def serveForever(self):
+        """Handle requests until a ``stop`` request is received."""
+        while True:
+            connection, address = self._socket.accept()
+            with connection:
+                request = _readRequest(connection)
+                if request.get("command") == "stop":
+                    connection.sendall(b"\0" + b"0")
+                    return
+                status = self.handle(connection, request)
+                connection.sendall(b"\0" + str(status).encode())
+
+    def handle(self, connection, request):
+        """Fork a child to run the tests named in ``request`` and return its
+        exit status.
+        """
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            status = 2
+            try:
+                self._socket.close()
+                status = _runInChild(connection, request, self.setUpLayers)
+            finally:
+                os._exit(status)
+        return os.waitstatus_to_exitcode(os.waitpid(pid, 0)[1])
+
+
+def _readRequest(connection):
+    data = b""
+    while not data.endswith(b"\n"):
+        chunk = connection.recv(4096)
+        if not chunk:
+            break
+        data += chunk
+    return json.loads(data or b"{}")
+
+
+def _runInChild(connection, request, setUpLayers):
+    os.dup2(connection.fileno(), 1)
+    os.dup2(connection.fileno(), 2)
+    stream = sys.stdout = sys.stderr = open(
+        1, "w", buffering=1, encoding="utf-8", errors="replace", closefd=False
+    )
+
+    try:
+        if request.get("cwd"):
+            os.chdir(request["cwd"])
+        sys.path[:0] = request.get("path", [])
+
+        suite = unittest.TestSuite()
+        for name in request.get("tests", []):
+            suite.addTest(loadTests(name))
+
+        result = runTests(
+            suite,
+            setUpLayers,
+            stream,
+            verbosity=request.get("verbosity", 1),
+            processes=request.get("processes", 1),
+        )
+        return 0 if result.wasSuccessful() else 1
+    except BaseException:
+        import traceback
+
+        traceback.print_exc(file=stream)
+        return 2
+    finally:
+        stream.flush()
+
+
+def loadTests(name):
+    """Return the tests for a dotted ``name``. For a module with a
+    ``test_suite()`` function, that is called. Otherwise, ``unittest`` finds
+    the tests of the module, class or method.
+    """
+    try:
+        module = importlib.import_module(name)
+    except ImportError:
+        return unittest.defaultTestLoader.loadTestsFromName(name)
+    if hasattr(module, "test_suite"):
+        return module.test_suite()
+    return unittest.defaultTestLoader.loadTestsFromModule(module)
+
+
+def runTests(suite, setUpLayers, stream, verbosity=1, processes=1):
+    """Run the tests in ``suite`` layer by layer with a
+    ``unittest.TextTestRunner`` writing to ``stream``, and return the
+    result. Layers in the dict ``setUpLayers`` are not set up again. Layers
+    set up for the tests are torn down at the end.
+    """
+    testRunner = unittest.TextTestRunner(stream=stream, verbosity=verbosity)
+    return testRunner.run(_LayeredSuite(suite, setUpLayers, processes))
+
+
+class _LayeredSuite(unittest.BaseTestSuite):
+    """Run the tests of a suite with ``runner.runLayers()``."""
+
+    def __init__(self, suite, setUpLayers, processes):
+        super().__init__([suite])
+        self.setUpLayers = setUpLayers
+        self.processes = processes
+
+    def run(self, result):
+        return runner.runLayers(
+            self, result, processes=self.processes, setUpLayers=self.setUpLayers
+        )
+
+
+def run(socketPath, tests, path=(), verbosity=1, processes=1, stream=None):
+    """Ask the zygote at ``socketPath`` to run the tests with the dotted
+    names ``tests``. The directories in ``path`` are put in front of
+    ``sys.path`` first. The output is written to ``stream``, by default
+    ``sys.stdout``. Return the exit status of the run.
+    """
+    request = {
+        "command": "run",
+        "tests": list(tests),
+        "path": [os.path.abspath(directory) for directory in path],
+        "cwd": os.getcwd(),
+        "verbosity": verbosity,
+        "processes": processes,
+    }
+    return _send(socketPath, request, stream)
+
+
+def stop(socketPath):
+    """Ask the zygote at ``socketPath`` to tear down its layers and exit."""
+    return _send(socketPath, {"command": "stop"}, None)
+
+
+def _send(socketPath, request, stream):
+    if stream is None:
+        stream = sys.stdout
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(socketPath)
+        connection.sendall(json.dumps(request).encode() + b"\n")
+
+        # The output is followed by a NUL byte and the exit status.
+        decoder = codecs.getincrementaldecoder("utf-8")("replace")
+        data = b""
+        while True:
+            chunk = connection.recv(65536)
+            if not chunk:
+                break
+            output, marker, status = (data + chunk).rpartition(b"\0")
+            if not marker:
+                output, status = status, b""
+            stream.write(decoder.decode(output))
+            data = marker + status
+
+    status = data[1:]
+    return int(status) if status else 2
+
+
+def resolve(dottedName):
+    """Return the object with the given dotted name, such as a layer."""
+    moduleName, attribute = dottedName.rsplit(".", 1)
+    return getattr(importlib.import_module(moduleName), attribute)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m plone.testing.zygote")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serveParser = commands.add_parser(
+        "serve", help="Set up layers and wait for run requests."
+    )
+    serveParser.add_argument("socket")
+    serveParser.add_argument(
+        "--layer",
+        action="append",
+        dest="layers",
+        help="Dotted name of a layer to keep set up, in addition to "
+        "plone.testing.zope.STARTUP. Can be repeated.",
+    )
+
+    runParser = commands.add_parser("run", help="Run tests in a zygote.")
+    runParser.add_argument("socket")
+    runParser.add_argument(
+        "tests", nargs="+", help="Dotted names of test modules, classes or methods."
+    )
+    runParser.add_argument(
+        "--path",
+        action="append",
+        default=[],
+        help="Directory to put in front of sys.path. Can be repeated.",
+    )
+    runParser.add_argument("-v", "--verbose", action="count", default=1)
+    runParser.add_argument("-j", "--processes", type=int, default=1)
+
+    stopParser = commands.add_parser("stop", help="Stop a zygote.")
+    stopParser.add_argument("socket")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        names = list(DEFAULT_LAYERS) + (args.layers or [])
+        zygote = Zygote(args.socket, [resolve(name) for name in names])
+        zygote.setUp()
+        print(f"Zygote listening on {args.socket}")
+        try:
+            zygote.serveForever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            zygote.tearDown()
+        return 0
+    elif args.command == "run":
+        return run(
+            args.socket,
+            args.tests,
+            path=args.path,
+            verbosity=args.verbose,
+            processes=args.processes,
+        )
+    else:
+        return stop(args.socket)
+
+
+if __name__ == "__main__":
+    sys.exit(main())